@@ -33,15 +33,33 @@ mkdir -p configs/c.1/strings/0x409
 echo 250 > configs/c.1/MaxPower
 
 echo "Setting Up USB Input Device Functions..."
-LOW_SPEED_DESC = \\x05\\x01\\x09\\x06\\xa1\\x01\\x05\\x07\\x19\\xe0\\x29\\xe7\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\x08\\x81\\x02\\x95\\x01\\x75\\x08\\x81\\x03\\x95\\x05\\x75\\x01\\x05\\x08\\x19\\x01\\x29\\x05\\x91\\x02\\x95\\x01\\x75\\x03\\x91\\x03\\x95\\x06\\x75\\x08\\x15\\x00\\x25\\x65\\x05\\x07\\x19\\x00\\x29\\x65\\x81\\x00\\xc0
-HIGH_SPEED_DESC = \\x05\\x01\\x09\\x06\\xa1\\x01\\x05\\x07\\x19\\xe0\\x29\\xe7\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\x08\\x81\\x02\\x19\\x00\\x29\\x67\\x95\\x68\\x81\\x02\\x05\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\x05\\x91\\x02\\x75\\x03\\x95\\x01\\x91\\x91\\xc0
+# Boot keyboard: modifier byte, reserved byte, 6 key array, and the 5 LEDs as output, the standard boot report a BIOS/UEFI host reads, see usb_kb_output.py
+BOOT_DESC=\\x05\\x01\\x09\\x06\\xa1\\x01\\x05\\x07\\x19\\xe0\\x29\\xe7\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\x08\\x81\\x02\\x95\\x01\\x75\\x08\\x81\\x01\\x95\\x05\\x75\\x01\\x05\\x08\\x19\\x01\\x29\\x05\\x91\\x02\\x95\\x01\\x75\\x03\\x91\\x01\\x95\\x06\\x75\\x08\\x15\\x00\\x26\\xdf\\x00\\x05\\x07\\x19\\x00\\x29\\xdf\\x81\\x00\\xc0
 mkdir -p functions/hid.usb0
 echo 1 > functions/hid.usb0/protocol
 echo 1 > functions/hid.usb0/subclass
 echo 8 > functions/hid.usb0/report_length
-echo -ne $LOW_SPEED_DESC > functions/hid.usb0/report_desc
+echo -ne $BOOT_DESC > functions/hid.usb0/report_desc
 ln -s functions/hid.usb0 configs/c.1/
 
+# Media keys: Consumer Control (report 1) and System Control (report 2), see usb_media_output.py
+MEDIA_DESC=\\x05\\x0c\\x09\\x01\\xa1\\x01\\x85\\x01\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\x13\\x09\\xcd\\x09\\xb7\\x09\\xb6\\x09\\xb5\\x09\\xb8\\x09\\xe9\\x09\\xea\\x09\\xe2\\x0a\\x96\\x01\\x0a\\x24\\x02\\x0a\\x25\\x02\\x0a\\x26\\x02\\x0a\\x21\\x02\\x0a\\x33\\x02\\x0a\\x34\\x02\\x0a\\x85\\x01\\x0a\\x9e\\x01\\x0a\\x27\\x02\\x0a\\x92\\x01\\x81\\x02\\x95\\x05\\x81\\x03\\xc0\\x05\\x01\\x09\\x80\\xa1\\x01\\x85\\x02\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\x01\\x09\\x82\\x81\\x02\\x95\\x07\\x81\\x03\\xc0
+mkdir -p functions/hid.usb1
+echo 0 > functions/hid.usb1/protocol
+echo 0 > functions/hid.usb1/subclass
+echo 4 > functions/hid.usb1/report_length
+echo -ne $MEDIA_DESC > functions/hid.usb1/report_desc
+ln -s functions/hid.usb1 configs/c.1/
+
+# NKRO keys: a 224 bit bitmap of usages 0x00-0xdf, for the keys past the boot keyboard's 6, see usb_kb_output.py
+NKRO_DESC=\\x05\\x01\\x09\\x06\\xa1\\x01\\x05\\x07\\x19\\x00\\x29\\xdf\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\xe0\\x81\\x02\\xc0
+mkdir -p functions/hid.usb2
+echo 0 > functions/hid.usb2/protocol
+echo 0 > functions/hid.usb2/subclass
+echo 28 > functions/hid.usb2/report_length
+echo -ne $NKRO_DESC > functions/hid.usb2/report_desc
+ln -s functions/hid.usb2 configs/c.1/
+
 echo "Setting Up USB Mass Storage Device Functions"
 mkdir -p functions/mass_storage.usb0
 echo 1 > functions/mass_storage.usb0/stall
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Offline benchmark of the scan pipeline, against a simulated pigpiod and a virtual key
+# matrix typing a scripted trace. Run from this directory:
+#
+#   python benchmark.py --latency-us 60 --min-scan-rate 1000
+#
+# Exits with 1 if any scan mode misses --min-scan-rate or --max-latency-ms, so it can be
+# used as a regression gate.
+
+import argparse
+import os
+import sys
+import time
+
+try:
+    import pigpio
+except ImportError:
+    import fake_pigpio as pigpio
+    sys.modules["pigpio"] = pigpio
+
+import fake_pigpio
+from debounce import make_debounce
+from gpio_matrix_kb import GPIOMatrix
+from keymap import load_keymap
+from latency import Histogram
+from scanner import Scanner
+from shift_matrix_kb import ShiftRegisterMatrix
+from usb_hid_scancodes import scancodes
+from usb_kb_output import UsbKeyboardOutput
+
+KEYMAP_FILE = "../keyboards/Corsair/Vengeance K65/default_keymap.json"
+TEXT = "the quick brown fox jumps over the lazy dog 1234567890"
+
+
+class CaptureOutput(UsbKeyboardOutput):
+
+    '''
+    UsbKeyboardOutput writing to /dev/null, keeping (time_ns, usages) for every report
+    that was written.
+
+    '''
+
+    def __init__(self):
+        super().__init__(os.devnull, nkro_device=os.devnull)
+        self.reports = []
+        self._usages = 0
+
+    def build_nkro(self, usages):
+        self._usages = usages
+        return super().build_nkro(usages)
+
+    def build_6kro(self, usages):
+        self._usages = usages
+        return super().build_6kro(usages)
+
+    def write_report(self, report):
+        written = super().write_report(report)
+        if written:
+            self.reports.append((time.perf_counter_ns(), self._usages))
+        return written
+
+
+# Returns a typing trace for VirtualMatrix, only keys the keymap has are typed
+def typing_trace(keymap, text, wpm=80, hold_ms=40, start_ms=100):
+    positions = {}
+    for i, row_codes in enumerate(keymap.codes):
+        for j, code in enumerate(row_codes):
+            positions.setdefault(code, (i, j))
+
+    interval_ns = int(60e9 / (wpm * 5))
+    hold_ns = int(hold_ms * 1e6)
+    trace = []
+    t = int(start_ms * 1e6)
+    for char in text:
+        code = scancodes.get("KEY_SPACE" if char == " " else f"KEY_{char.upper()}")
+        if code not in positions:
+            continue
+        row, col = positions[code]
+        trace.append((t, row, col, True))
+        trace.append((t + hold_ns, row, col, False))
+        t += interval_ns
+    trace.sort()
+    return trace
+
+
+# Tight loop of scans, returns (scans per second, pigpio calls per scan)
+def bench_scan(matrix, client, duration):
+    calls = client.calls
+    count = 0
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        matrix.scan()
+        count += 1
+    elapsed = time.perf_counter() - start
+    return count / elapsed, (client.calls - calls) / count
+
+
+# Runs the trace through a Scanner, returns (latency histogram, missed key presses)
+def bench_pipeline(matrix, virtual, keymap, trace, rate, debounce):
+    output = CaptureOutput()
+    scanner = Scanner(matrix, keymap, make_debounce(debounce, 5, rate), output, rate=rate)
+    scanner.start()
+    virtual.start()
+    while not virtual.done:
+        time.sleep(0.05)
+    time.sleep(0.1)
+    scanner.stop()
+    scanner.join()
+
+    histogram = Histogram()
+    missed = 0
+    reports = output.reports
+    for t, row, col, down in trace:
+        if not down:
+            continue
+        pressed_at = virtual.start_ns + t
+        bit = 1 << keymap.codes[row][col]
+        for reported_at, usages in reports:
+            if reported_at >= pressed_at and usages & bit:
+                histogram.record(reported_at - pressed_at)
+                break
+        else:
+            missed += 1
+    return histogram, missed
+
+
+def make_cases(keymap, trace, latency_us):
+    for mode in ("bitbang", "spi", "script"):
+        virtual = fake_pigpio.VirtualMatrix(keymap.rows, keymap.cols, trace)
+        board = fake_pigpio.ShiftRegisterBoard(virtual, ShiftRegisterMatrix.OUT_PINS, ShiftRegisterMatrix.IN_PINS,
+                                               ShiftRegisterMatrix.OUT_CHIPS, ShiftRegisterMatrix.IN_CHIPS)
+        client = fake_pigpio.pi(board, latency_us)
+        yield f"shift {mode}", client, virtual, lambda client=client, mode=mode: ShiftRegisterMatrix(client, mode)
+
+    virtual = fake_pigpio.VirtualMatrix(keymap.rows, keymap.cols, trace)
+    board = fake_pigpio.DirectBoard(virtual, GPIOMatrix.ROW_PINS, GPIOMatrix.COL_PINS)
+    client = fake_pigpio.pi(board, latency_us)
+    yield "gpio", client, virtual, lambda: GPIOMatrix(client)
+
+
+def bench_output(duration):
+    output = CaptureOutput()
+    usages = (1 << scancodes["KEY_A"], 1 << scancodes["KEY_B"] | 1 << 0xe1)
+    count = 0
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        output.write_nkro(usages[count & 1])
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the KeyLimePi scan pipeline off the Pi")
+    parser.add_argument("--keymap", default=KEYMAP_FILE)
+    parser.add_argument("--latency-us", type=float, default=60, help="simulated pigpiod round trip")
+    parser.add_argument("--duration", type=float, default=1, help="seconds per scan rate measurement")
+    parser.add_argument("--rate", type=int, default=1000, help="scanner rate for the latency run")
+    parser.add_argument("--debounce", default="eager")
+    parser.add_argument("--text", default=TEXT, help="text typed for the latency run")
+    parser.add_argument("--wpm", type=int, default=80)
+    parser.add_argument("--min-scan-rate", type=float, default=0)
+    parser.add_argument("--max-latency-ms", type=float, default=0, help="limit on p99 latency")
+    args = parser.parse_args()
+
+    keymap = load_keymap(args.keymap, ShiftRegisterMatrix.COLS)
+    trace = typing_trace(keymap, args.text, args.wpm)
+
+    failed = False
+    print(f"{'case':<16}{'scans/s':>10}{'calls/scan':>12}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'missed':>8}")
+    for name, client, virtual, make_matrix in make_cases(keymap, trace, args.latency_us):
+        try:
+            matrix = make_matrix()
+            scan_rate, calls_per_scan = bench_scan(matrix, client, args.duration)
+            histogram, missed = bench_pipeline(matrix, virtual, keymap, trace, args.rate, args.debounce)
+        except Exception as e:
+            print(f"{name:<16}failed: {e!r}")
+            failed = True
+            continue
+
+        count, values, max_ns = histogram.summary()
+        print(f"{name:<16}{scan_rate:>10.0f}{calls_per_scan:>12.1f}"
+              f"{values[50] / 1e6:>10.2f}{values[99] / 1e6:>10.2f}{max_ns / 1e6:>10.2f}{missed:>8}")
+        if scan_rate < args.min_scan_rate or missed:
+            failed = True
+        if args.max_latency_ms and values[99] / 1e6 > args.max_latency_ms:
+            failed = True
+
+    print(f"UsbKeyboardOutput: {bench_output(args.duration):.0f} reports/s")
+    sys.exit(1 if failed else 0)
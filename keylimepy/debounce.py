@@ -0,0 +1,154 @@
+from collections import deque
+
+# All debouncers work on the whole matrix state at once (bit row * cols + col set while
+# the key is down), update() takes the raw scan and a monotonic time in ns and returns
+# the debounced state.
+#
+# rejections counts the raw key changes thrown away as bounce, it's only incremented
+# while a key bounces so steady scans don't pay for it.
+
+def _bits(x):
+    return bin(x).count("1")
+
+
+class NoDebounce:
+    def __init__(self, ms=0, scan_rate=None):
+        self.state = 0
+        self.rejections = 0
+
+    def update(self, raw, now):
+        self.state = raw
+        return raw
+
+
+class EagerDebounce:
+
+    '''
+    Reports every edge on the first scan that sees it, then ignores that key for ms.
+
+    Keys are locked in groups that changed on the same scan. Lockouts all last the same
+    time, so they expire in the order they were added and a deque of (deadline, mask) is
+    enough to unlock them.
+
+    '''
+
+    def __init__(self, ms, scan_rate=None):
+        self._lockout_ns = int(ms * 1000000)
+        self._locked = 0
+        self._expiry = deque()
+        self._raw = 0
+        self.state = 0
+        self.rejections = 0
+
+    def update(self, raw, now):
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            self._locked &= ~expiry.popleft()[1]
+
+        # Edges of locked keys are bounce
+        bounced = (raw ^ self._raw) & self._locked
+        if bounced:
+            self.rejections += _bits(bounced)
+        self._raw = raw
+
+        changed = (raw ^ self.state) & ~self._locked
+        if changed:
+            self.state ^= changed
+            self._locked |= changed
+            expiry.append((now + self._lockout_ns, changed))
+        return self.state
+
+
+class DeferredDebounce:
+
+    '''
+    Reports a change once the whole matrix has read the same for ms, so presses and
+    releases are both delayed by ms.
+
+    '''
+
+    def __init__(self, ms, scan_rate=None):
+        self._delay_ns = int(ms * 1000000)
+        self._raw = 0
+        self._deadline = 0
+        self.state = 0
+        self.rejections = 0
+
+    def update(self, raw, now):
+        if raw != self._raw:
+            # Keys that changed again before they were reported
+            self.rejections += _bits((raw ^ self._raw) & (self._raw ^ self.state))
+            self._raw = raw
+            self._deadline = now + self._delay_ns
+        elif raw != self.state and now >= self._deadline:
+            self.state = raw
+        return self.state
+
+
+class CounterDebounce:
+
+    '''
+    Reports a key's change once it has read the new state for a number of scans in a row,
+    counted for each key independently.
+
+    The counters are vertical, plane k holds bit k of every key's counter, so counting
+    all keys at once is a handful of integer operations per plane. The count is worked
+    out from ms and the scan rate, so the delay is only as steady as the scan rate.
+
+    '''
+
+    def __init__(self, ms, scan_rate):
+        self._count = max(1, round(ms * scan_rate / 1000))
+        self._planes = [0] * self._count.bit_length()
+        self._counting = False
+        self.state = 0
+        self.rejections = 0
+
+    def update(self, raw, now):
+        delta = raw ^ self.state
+        planes = self._planes
+        if self._counting:
+            # Keys that were counting but went back
+            counting = 0
+            for plane in planes:
+                counting |= plane
+            bounced = counting & ~delta
+            if bounced:
+                self.rejections += _bits(bounced)
+        if not delta:
+            if self._counting:
+                planes[:] = [0] * len(planes)
+                self._counting = False
+            return self.state
+
+        # Increment the counters of keys that differ, keys that went back start over
+        carry = delta
+        for k, plane in enumerate(planes):
+            plane &= delta
+            planes[k] = plane ^ carry
+            carry &= plane
+
+        # Keys whose counter reached the count
+        done = delta
+        for k, plane in enumerate(planes):
+            done &= plane if self._count >> k & 1 else ~plane
+
+        if done:
+            self.state ^= done
+            for k, plane in enumerate(planes):
+                planes[k] = plane & ~done
+        self._counting = True
+        return self.state
+
+
+DEBOUNCE_MODES = {
+    "none": NoDebounce,
+    "eager": EagerDebounce,
+    "deferred": DeferredDebounce,
+    "counter": CounterDebounce,
+}
+
+def make_debounce(mode, ms, scan_rate):
+    if mode not in DEBOUNCE_MODES:
+        raise ValueError(f"Unknown debounce mode: {mode}")
+    return DEBOUNCE_MODES[mode](ms, scan_rate)
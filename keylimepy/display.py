@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+PAGE_ROWS = 8  # Pixel rows per SH1106 page, one bit of each display byte
+GLYPH_CHARS = "".join(map(chr, range(0x20, 0x7f)))
+
+class SH1106Pages:
+
+    '''
+    This class writes a column range of one page straight to an SH1106 over I2C, so an
+    update only sends the bytes that changed instead of the whole 1 KiB frame.
+
+    The SH1106 has 132 columns of display RAM with the 128 visible ones starting at
+    column 2. A page address and column address command is followed by the data, split
+    into the 32 byte blocks SMBus allows.
+
+    '''
+
+    COLUMN_OFFSET = 2
+    BLOCK_BYTES = 32
+    CONTROL_COMMAND = 0x00
+    CONTROL_DATA = 0x40
+
+    def __init__(self, port=1, address=0x3C):
+        import smbus
+        self._bus = smbus.SMBus(port)
+        self._address = address
+
+    def write(self, page, column, data):
+        column += self.COLUMN_OFFSET
+        self._bus.write_i2c_block_data(self._address, self.CONTROL_COMMAND,
+                                       [0xb0 | page, column & 0x0f, 0x10 | column >> 4])
+        for i in range(0, len(data), self.BLOCK_BYTES):
+            self._bus.write_i2c_block_data(self._address, self.CONTROL_DATA, list(data[i:i + self.BLOCK_BYTES]))
+
+
+class StatusDisplay(threading.Thread):
+
+    '''
+    This thread owns the OLED and shows named status lines on it, so nothing else ever
+    waits on PIL or the I2C bus.
+
+    PIL, cheap_oled and the font are only imported and opened once the thread starts, so
+    it can be started after the scan loop is already running. Every printable ASCII
+    character is then rendered once into a glyph of page bytes, and a line is drawn by
+    copying glyph columns, PIL isn't used again.
+
+    set() can be called from any thread before or after that, it only stores the latest
+    text of each line and wakes the thread, so updates made faster than the thread draws
+    are merged and only the latest text is shown. Each line is a band of whole pages, the
+    thread keeps a copy of the display's pages and only writes the columns of a page that
+    changed. Frames are at most max_fps apart, and the thread runs at a low nice value so
+    it doesn't compete with the scan thread.
+
+    '''
+
+    WIDTH = 128
+    PAGES = 8
+    NICE = 10
+
+    def __init__(self, font_path, font_size=16, lines=("error", "leds", "rate"), port=1, address=0x3C, max_fps=10):
+        super().__init__(name="display", daemon=True)
+        self.font_path = font_path
+        self.font_size = font_size
+        self.port = port
+        self.address = address
+        self._min_frame_s = 1 / max_fps
+        self.ready = threading.Event()  # Set once the OLED is set up
+        self._lines = dict.fromkeys(lines, "")
+        self._drawn = {}  # Text on the display, per line
+        self._dirty = threading.Event()
+        self._dirty.set()
+        self._frame = bytearray(self.WIDTH * self.PAGES)
+        self._glyphs = {}
+        self._line_pages = 1
+
+    def set(self, **lines):
+        self._lines.update(lines)
+        self._dirty.set()
+
+    def _load_glyphs(self):
+        from PIL import Image, ImageDraw, ImageFont
+
+        font = ImageFont.truetype(self.font_path, self.font_size)
+        ascent, descent = font.getmetrics()
+        self._line_pages = min(-(-(ascent + descent) // PAGE_ROWS), self.PAGES)
+        height = self._line_pages * PAGE_ROWS
+        for char in GLYPH_CHARS:
+            width = max(int(round(font.getlength(char))), 1)
+            image = Image.new("1", (width, height))
+            ImageDraw.Draw(image).text((0, 0), char, fill=1, font=font)
+            pixels = image.load()
+            self._glyphs[char] = tuple(
+                bytes(sum(1 << bit for bit in range(PAGE_ROWS) if pixels[x, page * PAGE_ROWS + bit])
+                      for x in range(width))
+                for page in range(self._line_pages)
+            )
+
+    # Returns the page bytes of a line of text, clipped to the display width
+    def _render(self, text):
+        pages = [bytearray(self.WIDTH) for _ in range(self._line_pages)]
+        unknown = self._glyphs["?"]
+        x = 0
+        for char in text:
+            glyph = self._glyphs.get(char, unknown)
+            width = min(len(glyph[0]), self.WIDTH - x)
+            for page, columns in zip(pages, glyph):
+                page[x:x + width] = columns[:width]
+            x += width
+            if x >= self.WIDTH:
+                break
+        return pages
+
+    # Writes the columns of each page that differ from what the display shows
+    def _draw(self, first_page, pages):
+        frame = self._frame
+        for page, data in enumerate(pages, first_page):
+            if page >= self.PAGES:
+                break
+            offset = page * self.WIDTH
+            shown = frame[offset:offset + self.WIDTH]
+            if shown == data:
+                continue
+            start = 0
+            while shown[start] == data[start]:
+                start += 1
+            end = self.WIDTH
+            while shown[end - 1] == data[end - 1]:
+                end -= 1
+            frame[offset + start:offset + end] = data[start:end]
+            self._oled.write(page, start, data[start:end])
+
+    def run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.NICE)
+        except (OSError, AttributeError):
+            pass
+
+        from cheap_oled import OLED_SH1106
+
+        # cheap_oled sets the display up, pages are written directly from then on
+        OLED_SH1106(port=self.port, address=self.address)
+        self._oled = SH1106Pages(self.port, self.address)
+        for page in range(self.PAGES):
+            self._oled.write(page, 0, bytes(self.WIDTH))
+        self._load_glyphs()
+        self.ready.set()
+
+        last_frame = 0
+        while True:
+            self._dirty.wait()
+            delay = last_frame + self._min_frame_s - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._dirty.clear()
+            last_frame = time.monotonic()
+
+            for i, (name, text) in enumerate(list(self._lines.items())):
+                if self._drawn.get(name) != text:
+                    self._draw(i * self._line_pages, self._render(text))
+                    self._drawn[name] = text
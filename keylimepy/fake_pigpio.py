@@ -0,0 +1,352 @@
+import time
+
+# Simulated pigpio client, for running and benchmarking the scan code off the Pi.
+# Constants match the real pigpio module, so either can be imported by the scan code.
+
+INPUT = 0
+OUTPUT = 1
+
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+
+PI_SCRIPT_INITING = 0
+PI_SCRIPT_HALTED = 1
+PI_SCRIPT_RUNNING = 2
+PI_SCRIPT_WAITING = 3
+PI_SCRIPT_FAILED = 4
+
+
+class VirtualMatrix:
+
+    '''
+    Key matrix driven by a typing trace, a list of (time_ns, row, col, down) sorted by
+    time. Times are relative to start(), or to the first call to columns() if start()
+    isn't called.
+
+    '''
+
+    def __init__(self, rows, cols, trace=()):
+        self.rows = rows
+        self.cols = cols
+        self._trace = list(trace)
+        self._next = 0
+        self._row_state = [0] * rows
+        self._start = None
+
+    def start(self, start_ns=None):
+        self._start = time.perf_counter_ns() if start_ns is None else start_ns
+        self._next = 0
+        self._row_state = [0] * self.rows
+
+    @property
+    def start_ns(self):
+        return self._start
+
+    @property
+    def done(self):
+        return self._next >= len(self._trace)
+
+    def _advance(self):
+        if self._start is None:
+            self.start()
+        now = time.perf_counter_ns() - self._start
+        trace = self._trace
+        while self._next < len(trace) and trace[self._next][0] <= now:
+            _, row, col, down = trace[self._next]
+            if down:
+                self._row_state[row] |= 1 << col
+            else:
+                self._row_state[row] &= ~(1 << col)
+            self._next += 1
+
+    # Column bits seen while the rows set in row_mask are driven
+    def columns(self, row_mask):
+        self._advance()
+        cols = 0
+        for i, row_state in enumerate(self._row_state):
+            if row_mask >> i & 1:
+                cols |= row_state
+        return cols
+
+
+class ShiftRegisterBoard:
+
+    '''
+    A SN74HC595 chain driving the rows and a SN74HC165 chain reading the columns of a
+    VirtualMatrix, wired to pins as in shift_matrix_kb.ShiftRegisterMatrix.
+
+    The SPI bus is wired as in shiftreg_spi.SpiShiftReg, with the 165 SH/LD on the same
+    pin as the bit-banged chain.
+
+    '''
+
+    def __init__(self, matrix, out_pins=(16, 20, 21), in_pins=(9, 25, 11), out_chips=1, in_chips=2):
+        self.matrix = matrix
+        self.ser, self.rclk, self.srclk = out_pins
+        self.qh, self.sh_ld, self.clk = in_pins
+        self._out_mask = (1 << out_chips * 8) - 1
+        self._in_bits = in_chips * 8
+        self._in_mask = (1 << self._in_bits) - 1
+        self.levels = {self.sh_ld: 1}
+        self.out_shift = 0
+        self.out_latch = 0
+        self.in_shift = 0
+
+    def _load(self):
+        cols = self.matrix.columns(self.out_latch)
+        # The first bit shifted out (last chip's H) is column 0
+        shift = 0
+        for j in range(self._in_bits):
+            shift |= (cols >> j & 1) << (self._in_bits - 1 - j)
+        self.in_shift = shift
+
+    def _clock_out(self, bit):
+        self.out_shift = (self.out_shift << 1 | bit) & self._out_mask
+
+    def _clock_in(self):
+        self.in_shift = self.in_shift << 1 & self._in_mask
+
+    def write(self, pin, level):
+        level = 1 if level else 0
+        rising = level and not self.levels.get(pin, 0)
+        self.levels[pin] = level
+        if rising and pin == self.srclk:
+            self._clock_out(self.levels.get(self.ser, 0))
+        if rising and pin == self.rclk:
+            self.out_latch = self.out_shift
+        if pin == self.sh_ld and not level:
+            self._load()
+        if rising and pin == self.clk and self.levels[self.sh_ld]:
+            self._clock_in()
+
+    def read(self, pin):
+        if pin == self.qh:
+            if not self.levels[self.sh_ld]:
+                self._load()
+            return self.in_shift >> (self._in_bits - 1) & 1
+        return self.levels.get(pin, 0)
+
+    def spi_xfer(self, data):
+        rx = bytearray(len(data))
+        for i, byte in enumerate(data):
+            for k in range(7, -1, -1):
+                rx[i] |= self.read(self.qh) << k
+                self._clock_out(byte >> k & 1)
+                self._clock_in()
+        # CE0 goes high at the end of the transfer and latches the 595s
+        self.out_latch = self.out_shift
+        return rx
+
+
+class DirectBoard:
+
+    '''
+    A VirtualMatrix wired straight to GPIOs, as in gpio_matrix_kb.GPIOMatrix.
+
+    '''
+
+    def __init__(self, matrix, row_pins, col_pins):
+        self.matrix = matrix
+        self.row_pins = row_pins
+        self.col_pins = col_pins
+        self.levels = {}
+
+    def write(self, pin, level):
+        self.levels[pin] = 1 if level else 0
+
+    def read(self, pin):
+        if pin in self.col_pins:
+            row_mask = 0
+            for i, row_pin in enumerate(self.row_pins):
+                row_mask |= self.levels.get(row_pin, 0) << i
+            return self.matrix.columns(row_mask) >> self.col_pins.index(pin) & 1
+        return self.levels.get(pin, 0)
+
+
+class _Callback:
+    def cancel(self):
+        return
+
+
+class pi:
+
+    '''
+    Stands in for pigpio.pi, forwarding pin reads and writes to a board. Every call
+    counts towards calls and busy-waits latency_us first, to mimic a pigpiod round trip.
+
+    '''
+
+    def __init__(self, board=None, latency_us=0):
+        self.board = board
+        self.connected = True
+        self.calls = 0
+        self._latency_ns = int(latency_us * 1000)
+        self._modes = {}
+        self._scripts = {}
+
+    def _call(self):
+        self.calls += 1
+        if self._latency_ns:
+            end = time.perf_counter_ns() + self._latency_ns
+            while time.perf_counter_ns() < end:
+                pass
+
+    def stop(self):
+        self.connected = False
+
+    def set_mode(self, gpio, mode):
+        self._call()
+        self._modes[gpio] = mode
+        return 0
+
+    def get_mode(self, gpio):
+        self._call()
+        return self._modes.get(gpio, INPUT)
+
+    def set_pull_up_down(self, gpio, pud):
+        self._call()
+        return 0
+
+    def write(self, gpio, level):
+        self._call()
+        self.board.write(gpio, level)
+        return 0
+
+    def read(self, gpio):
+        self._call()
+        return self.board.read(gpio)
+
+    def read_bank_1(self):
+        self._call()
+        bank = 0
+        for gpio in range(32):
+            bank |= self.board.read(gpio) << gpio
+        return bank
+
+    def set_bank_1(self, bits):
+        self._call()
+        for gpio in range(32):
+            if bits >> gpio & 1:
+                self.board.write(gpio, 1)
+        return 0
+
+    def clear_bank_1(self, bits):
+        self._call()
+        for gpio in range(32):
+            if bits >> gpio & 1:
+                self.board.write(gpio, 0)
+        return 0
+
+    def gpio_trigger(self, user_gpio, pulse_len=10, level=1):
+        self._call()
+        self.board.write(user_gpio, level)
+        self.board.write(user_gpio, not level)
+        return 0
+
+    def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+        self._call()
+        return _Callback()
+
+    def spi_open(self, spi_channel, baud, spi_flags=0):
+        self._call()
+        return spi_channel
+
+    def spi_close(self, handle):
+        self._call()
+        return 0
+
+    def spi_xfer(self, handle, data):
+        self._call()
+        rx = self.board.spi_xfer(data)
+        return len(rx), rx
+
+    def store_script(self, script):
+        self._call()
+        script_id = len(self._scripts)
+        self._scripts[script_id] = (_compile_script(script), [0] * 10)
+        return script_id
+
+    def delete_script(self, script_id):
+        self._call()
+        del self._scripts[script_id]
+        return 0
+
+    def run_script(self, script_id, params=None):
+        self._call()
+        cmds, script_params = self._scripts[script_id]
+        if params:
+            script_params[:len(params)] = params
+        _run_script(cmds, script_params, self.board)
+        return 0
+
+    def script_status(self, script_id):
+        self._call()
+        return PI_SCRIPT_HALTED, list(self._scripts[script_id][1])
+
+
+# Just enough of the pigpio script language for shiftreg_script.ScriptShiftReg
+
+_ARGS = {"W": 2, "R": 1, "LD": 2, "LDA": 1, "STA": 1, "OR": 1, "RLA": 1, "RRA": 1,
+         "DCR": 1, "JNZ": 1, "TAG": 1, "MICS": 1}
+
+def _compile_script(script):
+    words = script.split()
+    cmds = []
+    tags = {}
+    i = 0
+    while i < len(words):
+        cmd = words[i].upper()
+        args = words[i + 1:i + 1 + _ARGS[cmd]]
+        i += 1 + len(args)
+        if cmd == "TAG":
+            tags[args[0]] = len(cmds)
+        else:
+            cmds.append((cmd, args))
+    return [(cmd, [tags[args[0]]] if cmd == "JNZ" else args) for cmd, args in cmds]
+
+def _run_script(cmds, params, board):
+    variables = {}
+
+    def value(arg):
+        if arg[0] == "v":
+            return variables.get(arg, 0)
+        if arg[0] == "p":
+            return params[int(arg[1:])]
+        return int(arg)
+
+    a = 0
+    pc = 0
+    while pc < len(cmds):
+        cmd, args = cmds[pc]
+        pc += 1
+        if cmd == "W":
+            board.write(int(args[0]), int(args[1]))
+        elif cmd == "R":
+            a = board.read(int(args[0]))
+        elif cmd == "LD":
+            variables[args[0]] = value(args[1])
+        elif cmd == "LDA":
+            a = value(args[0])
+        elif cmd == "STA":
+            if args[0][0] == "p":
+                params[int(args[0][1:])] = a
+            else:
+                variables[args[0]] = a
+        elif cmd == "OR":
+            a |= value(args[0])
+        elif cmd == "RLA":
+            n = value(args[0]) % 32
+            a = (a << n | a >> (32 - n)) & 0xffffffff
+        elif cmd == "RRA":
+            n = value(args[0]) % 32
+            a = (a >> n | a << (32 - n)) & 0xffffffff
+        elif cmd == "DCR":
+            variables[args[0]] = value(args[0]) - 1
+        elif cmd == "JNZ":
+            if a:
+                pc = args[0]
@@ -0,0 +1,68 @@
+GHOST_POLICIES = ("suppress", "rollover")
+ERR_OVF_USAGE = 0x01  # KEY_ERR_OVF
+
+class GhostFilter:
+
+    '''
+    This class catches ghost keys on a matrix without a diode per key.
+
+    Without diodes, three keys on the corners of a rectangle also close the fourth corner,
+    so any two rows sharing two or more pressed columns can't be told apart from a ghost.
+    filter() checks for that with one AND per pair of rows that have keys down. A scan with
+    the same state as the last one (e.g. a retry after EAGAIN) gets the last result back
+    without being checked or counted again.
+
+    The keys on an ambiguous rectangle keep the state last reported for them, so a
+    ghost never goes down. With the "suppress" policy that's all, with "rollover" the
+    report also carries KEY_ERR_OVF (rollover_usages) while the rectangle is there.
+
+    '''
+
+    def __init__(self, rows, cols, policy="suppress"):
+        if policy not in GHOST_POLICIES:
+            raise ValueError(f"Unknown ghost policy {policy!r}, expected one of {GHOST_POLICIES}")
+        self.rows = rows
+        self.cols = cols
+        self.policy = policy
+        self._row_mask = (1 << cols) - 1
+        self._last = 0
+        self._last_state = 0  # State passed to the last filter()
+        self.rollover_usages = 0  # Usages to add to the report, KEY_ERR_OVF while rolled over
+        self.ghost_count = 0  # Matrix states that had an ambiguous rectangle
+
+    # Returns the matrix bits on rectangles of pressed keys, 0 if there are none
+    def ambiguous(self, state):
+        cols = self.cols
+        row_mask = self._row_mask
+        down = []
+        i = 0
+        while state:
+            row = state & row_mask
+            if row:
+                down.append((i, row))
+            state >>= cols
+            i += cols
+
+        ambiguous = 0
+        for n, (i, row) in enumerate(down):
+            for j, other in down[n + 1:]:
+                shared = row & other
+                # Two or more shared columns
+                if shared & (shared - 1):
+                    ambiguous |= shared << i | shared << j
+        return ambiguous
+
+    def filter(self, state):
+        if state == self._last_state:
+            return self._last
+        self._last_state = state
+        ambiguous = self.ambiguous(state)
+        if ambiguous:
+            self.ghost_count += 1
+            state = state & ~ambiguous | self._last & ambiguous
+            if self.policy == "rollover":
+                self.rollover_usages = 1 << ERR_OVF_USAGE
+        else:
+            self.rollover_usages = 0
+        self._last = state
+        return state
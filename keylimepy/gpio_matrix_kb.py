@@ -1,23 +1,75 @@
-import platform
-if any([e in platform.platform().lower() for e in ["darwin", "macos", "windows"]]):
-    import fake_gpio as GPIO
-else:
-    import RPi.GPIO as GPIO
+import pigpio
+
+from key_wake import KeyWake
 
 # Full GPIO Keyboard Matrix (no shift registers)
 class GPIOMatrix:
     ROW_PINS = (17, 18, 19, 20, 21, 22, 23, 24)
     COL_PINS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16)
 
-    def __init__(self):
-        GPIO.setup(self.ROW_PINS, GPIO.OUT)
-        GPIO.setup(self.COL_PINS, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-
-    def read(self, keymap_matrix):
-        for i, (row_keys) in enumerate(keymap_matrix):
-            GPIO.output(self.ROW_PINS[i], GPIO.HIGH)
-            for j, key in enumerate(row_keys):
-                if GPIO.input(self.COL_PINS[j]):
-                    yield key
-            GPIO.output(self.ROW_PINS[i], GPIO.LOW)
-        GPIO.cleanup()
\ No newline at end of file
+    # Pins are set up once for the life of the process, each row is then one write to
+    # drive it, one bank read for every column and one write to release it.
+    def __init__(self, pi):
+        self._pi = pi
+        self._row_mask = 0
+        for pin in self.ROW_PINS:
+            pi.set_mode(pin, pigpio.OUTPUT)
+            pi.write(pin, 0)
+            self._row_mask |= 1 << pin
+        for pin in self.COL_PINS:
+            pi.set_mode(pin, pigpio.INPUT)
+            pi.set_pull_up_down(pin, pigpio.PUD_DOWN)
+
+        # Bank bits to column bits, a shift and mask if the columns are consecutive
+        # GPIOs in order, otherwise one lookup table per byte of the bank
+        first = self.COL_PINS[0]
+        if self.COL_PINS == tuple(range(first, first + len(self.COL_PINS))):
+            self._col_shift = first
+            self._col_luts = None
+        else:
+            self._col_shift = None
+            self._col_luts = []
+            for start in range(0, 32, 8):
+                lut = [0] * 256
+                for value in range(256):
+                    for j, pin in enumerate(self.COL_PINS):
+                        if start <= pin < start + 8 and value >> (pin - start) & 1:
+                            lut[value] |= 1 << j
+                self._col_luts.append(lut)
+        self._col_mask = (1 << len(self.COL_PINS)) - 1
+
+        # Idling needs edge callbacks, which gpiomem.GpioMem doesn't have
+        self._wake = KeyWake(pi, self.COL_PINS) if hasattr(pi, "callback") else None
+
+    def _columns(self, bank):
+        if self._col_luts is None:
+            return bank >> self._col_shift & self._col_mask
+        cols = 0
+        for lut in self._col_luts:
+            cols |= lut[bank & 0xff]
+            bank >>= 8
+        return cols
+
+    # Returns the whole matrix as an int, bit (row * len(COL_PINS) + col) is set while that key is down
+    def scan(self):
+        pi = self._pi
+        num_cols = len(self.COL_PINS)
+        state = 0
+        for i, row_pin in enumerate(self.ROW_PINS):
+            pi.write(row_pin, 1)
+            bank = pi.read_bank_1()
+            pi.write(row_pin, 0)
+            state |= self._columns(bank) << (i * num_cols)
+        return state
+
+    @property
+    def can_idle(self):
+        return self._wake is not None
+
+    # Drives every row and blocks until a key goes down, returns False on timeout
+    def wait_for_key(self, timeout=None):
+        self._pi.set_bank_1(self._row_mask)
+        try:
+            return self._wake.wait(timeout)
+        finally:
+            self._pi.clear_bank_1(self._row_mask)
@@ -0,0 +1,105 @@
+import mmap
+import os
+import time
+
+import pigpio
+
+class GpioMem:
+
+    '''
+    This class drives the GPIOs from inside the process through a memory map of
+    /dev/gpiomem, so a pin read or write is a register access instead of a round trip to
+    pigpiod.
+
+    It has the pigpio.pi calls the matrix and selector classes use (set_mode, write,
+    read, the bank calls, set_pull_up_down and gpio_trigger), so it can be passed in place
+    of a pigpio.pi. There is no SPI, scripts or edge callbacks, so it only works with the
+    bit-banged shift register scan and a GPIOMatrix that doesn't idle.
+
+    path can be any file of at least a page, e.g. to try it off the Pi:
+
+        truncate -s 4096 /tmp/gpiomem && python -c "from gpiomem import GpioMem; GpioMem('/tmp/gpiomem').write(4, 1)"
+
+    '''
+
+    BLOCK_SIZE = 4096
+
+    # Register offsets, in 32-bit words
+    GPFSEL0 = 0x00 // 4
+    GPSET0 = 0x1c // 4
+    GPCLR0 = 0x28 // 4
+    GPLEV0 = 0x34 // 4
+    GPPUD = 0x94 // 4  # BCM2835-7 pull up/down
+    GPPUDCLK0 = 0x98 // 4
+    GPPUPPDN0 = 0xe4 // 4  # BCM2711 pull up/down
+    GPPUPPDN3 = 0xf0 // 4
+
+    # Unimplemented registers read back as "gpio" on the older chips
+    GPIO_MAGIC = 0x6770696f
+    # pigpio PUD_* to BCM2711 pull up/down bits
+    BCM2711_PULL = {pigpio.PUD_OFF: 0, pigpio.PUD_UP: 1, pigpio.PUD_DOWN: 2}
+
+    def __init__(self, path="/dev/gpiomem"):
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self._mem = mmap.mmap(fd, self.BLOCK_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self._reg = memoryview(self._mem).cast('I')
+        self._bcm2711 = self._reg[self.GPPUPPDN3] != self.GPIO_MAGIC
+        self.connected = True
+
+    def stop(self):
+        self._reg.release()
+        self._mem.close()
+        self.connected = False
+
+    def set_mode(self, gpio, mode):
+        reg = self.GPFSEL0 + gpio // 10
+        shift = gpio % 10 * 3
+        self._reg[reg] = self._reg[reg] & ~(7 << shift) | mode << shift
+        return 0
+
+    def get_mode(self, gpio):
+        return self._reg[self.GPFSEL0 + gpio // 10] >> (gpio % 10 * 3) & 7
+
+    def set_pull_up_down(self, gpio, pud):
+        if self._bcm2711:
+            reg = self.GPPUPPDN0 + gpio // 16
+            shift = gpio % 16 * 2
+            self._reg[reg] = self._reg[reg] & ~(3 << shift) | self.BCM2711_PULL[pud] << shift
+        else:
+            # Set the control signal, clock it into the pin, then remove both
+            self._reg[self.GPPUD] = pud
+            time.sleep(0.00002)
+            self._reg[self.GPPUDCLK0 + (gpio >> 5)] = 1 << (gpio & 31)
+            time.sleep(0.00002)
+            self._reg[self.GPPUD] = 0
+            self._reg[self.GPPUDCLK0 + (gpio >> 5)] = 0
+        return 0
+
+    def write(self, gpio, level):
+        self._reg[(self.GPSET0 if level else self.GPCLR0) + (gpio >> 5)] = 1 << (gpio & 31)
+        return 0
+
+    def read(self, gpio):
+        return self._reg[self.GPLEV0 + (gpio >> 5)] >> (gpio & 31) & 1
+
+    def read_bank_1(self):
+        return self._reg[self.GPLEV0]
+
+    def set_bank_1(self, bits):
+        self._reg[self.GPSET0] = bits
+        return 0
+
+    def clear_bank_1(self, bits):
+        self._reg[self.GPCLR0] = bits
+        return 0
+
+    def gpio_trigger(self, user_gpio, pulse_len=10, level=1):
+        self.write(user_gpio, level)
+        end = time.perf_counter_ns() + pulse_len * 1000
+        while time.perf_counter_ns() < end:
+            pass
+        self.write(user_gpio, not level)
+        return 0
@@ -0,0 +1,37 @@
+import threading
+
+class ProtocolWatcher(threading.Thread):
+
+    '''
+    This thread keeps a usb_kb_output.UsbKeyboardOutput in the protocol the host asked
+    for with SET_PROTOCOL, so a BIOS/UEFI host gets the 6KRO boot report and the OS gets
+    NKRO once it switches back, without a restart.
+
+    path is a file holding the host's protocol, 0 for boot or 1 for report, for a gadget
+    driver that exposes one. It's polled every interval seconds, off the scan thread. While
+    it's missing or unreadable the output is left in the fallback protocol.
+
+    '''
+
+    def __init__(self, output, path, fallback, interval=0.5):
+        super().__init__(name="hid-protocol", daemon=True)
+        self.output = output
+        self.path = path
+        self.fallback = fallback
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def read_protocol(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or self.fallback)
+        except (OSError, ValueError):
+            return self.fallback
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.output.set_protocol(self.read_protocol())
+            self._stop_event.wait(self.interval)
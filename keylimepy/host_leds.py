@@ -0,0 +1,80 @@
+import os
+import selectors
+import threading
+
+import pigpio
+
+# Bits of the LED output report, see the LED usages in NKRO_DESC in keylimepi.sh
+LED_NUM_LOCK = 0x01
+LED_CAPS_LOCK = 0x02
+LED_SCROLL_LOCK = 0x04
+LED_COMPOSE = 0x08
+LED_KANA = 0x10
+
+LED_NAMES = (
+    (LED_NUM_LOCK, "NUM"),
+    (LED_CAPS_LOCK, "CAPS"),
+    (LED_SCROLL_LOCK, "SCRL"),
+)
+
+class HostLedReader(threading.Thread):
+
+    '''
+    This thread reads the host's LED output reports from the keyboard gadget, so the lock
+    states can be shown on the display and LEDs.
+
+    It waits on the gadget fd the keyboard output already has open (non-blocking) with a
+    selector, so the scan thread never waits on it, and only wakes when the host sends a
+    report. leds holds the latest LED bits (LED_*). On a change, the LED pins are written
+    (led_pins maps an LED bit to a GPIO, driven high while that LED is on) and
+    on_change(leds) is called, from this thread.
+
+    '''
+
+    def __init__(self, fd, pi=None, led_pins=None, on_change=None):
+        super().__init__(name="host-leds", daemon=True)
+        self._fd = fd
+        self._pi = pi
+        self.led_pins = dict(led_pins or {})
+        self.on_change = on_change
+        self.leds = 0
+        self._wake_r, self._wake_w = os.pipe()
+
+        for pin in self.led_pins.values():
+            pi.set_mode(pin, pigpio.OUTPUT)
+            pi.write(pin, 0)
+
+    def stop(self):
+        os.write(self._wake_w, b"\0")
+
+    def _publish(self, leds):
+        changed = leds ^ self.leds
+        self.leds = leds
+        for bit, pin in self.led_pins.items():
+            if changed & bit:
+                self._pi.write(pin, 1 if leds & bit else 0)
+        if self.on_change is not None:
+            self.on_change(leds)
+
+    def run(self):
+        with selectors.DefaultSelector() as selector:
+            try:
+                selector.register(self._fd, selectors.EVENT_READ)
+            except PermissionError:
+                # Not a device that can be waited on, like the stand-in file used off the Pi
+                return
+            selector.register(self._wake_r, selectors.EVENT_READ)
+
+            while True:
+                for key, events in selector.select():
+                    if key.fd == self._wake_r:
+                        return
+                    try:
+                        report = os.read(self._fd, 64)
+                    except BlockingIOError:
+                        continue
+                    if not report:
+                        return
+                    leds = report[0]
+                    if leds != self.leds:
+                        self._publish(leds)
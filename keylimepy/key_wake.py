@@ -0,0 +1,44 @@
+import threading
+
+import pigpio
+
+class KeyWake:
+
+    '''
+    This class waits for any key to go down while the matrix is idle.
+
+    With every row driven, a key press raises its column line. The wake pins must see
+    that, which means the column GPIOs themselves on a direct wired matrix, or a line
+    ORing every column together on a shift register matrix, since a SN74HC165 only
+    shows one of its inputs on Qh.
+
+    pigpio calls back on the rising edge, so wait() returns within the callback latency
+    instead of a scan period.
+
+    '''
+
+    def __init__(self, pi, pins):
+        self._pi = pi
+        self._pins = pins
+        self._event = threading.Event()
+
+        for pin in pins:
+            pi.set_mode(pin, pigpio.INPUT)
+            pi.set_pull_up_down(pin, pigpio.PUD_DOWN)
+        self._callbacks = [pi.callback(pin, pigpio.RISING_EDGE, self._wake) for pin in pins]
+
+    def _wake(self, gpio, level, tick):
+        self._event.set()
+
+    def close(self):
+        for callback in self._callbacks:
+            callback.cancel()
+
+    # Call with every row driven, returns True once a key is down or False on timeout
+    def wait(self, timeout=None):
+        self._event.clear()
+        # A key that went down before the event was cleared won't make another edge
+        for pin in self._pins:
+            if self._pi.read(pin):
+                return True
+        return self._event.wait(timeout)
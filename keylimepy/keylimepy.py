@@ -2,56 +2,178 @@
 
 # KEYMAP_FILE = "/home/pi/KeyLimePi/usbdisk.d/keymap.json"
 KEYMAP_FILE = "../keyboards/Corsair/Vengeance K65/default_keymap.json"
+PROFILE_FILES = {}  # Selector switch position to keymap file, e.g. {1: "/home/pi/KeyLimePi/usbdisk.d/keymap1.json"}
+SELECTOR_PINS = ()  # GPIOs of the profile selector switch, bit i of the position is pin i
+KEYMAP_RELOAD_INTERVAL = 1  # s between checks for a changed keymap file, or None to never reload
+KEYMAP_CACHE_DIR = "/home/pi/KeyLimePi/cache"  # Compiled keymaps, kept off the USB disk, or None to always compile
+FONT_FILE = "/home/pi/KeyLimePi/keylimepy/oled/fonts/C&C Red Alert [INET].ttf"
+
+GPIO_DRIVER = "pigpio"  # "pigpio", or "gpiomem" to bypass pigpiod (only with the "bitbang" scan mode)
+SCAN_MODE = "bitbang"  # "bitbang", "spi" or "script", "spi" needs the 595 chain moved to SPI0: SER to MOSI (GPIO 10), SRCLK to SCLK (GPIO 11), RCLK to CE0 (GPIO 8), see shiftreg_spi.py
+SCAN_RATE = 1000  # Hz
+DEBOUNCE = "eager"  # "none", "eager", "deferred" or "counter"
+DEBOUNCE_MS = 5
+GHOST_POLICY = "suppress"  # Ghost keys on a matrix without diodes: "suppress", "rollover", or None if it has diodes
+IDLE_TIMEOUT = 2  # s with no keys down before waiting for a key press instead of scanning
+IDLE_SCAN_RATE = 100  # Hz, scanned this slowly after IDLE_TIMEOUT if the matrix can't wait for a key press
+SCAN_CPU = 3  # CPU to pin the scan thread to, or None
+SCAN_PRIORITY = 50  # SCHED_FIFO priority of the scan thread (needs root), or None
+STATS_INTERVAL = 10  # s
+HID_PROTOCOL = "auto"  # "auto" to follow HID_PROTOCOL_FILE, or always "boot" (6KRO, every key on the boot keyboard) or "nkro"
+HID_PROTOCOL_FALLBACK = "nkro"  # Used in "auto" while HID_PROTOCOL_FILE can't be read, a BIOS still reads the first 6 keys from the boot keyboard
+HID_PROTOCOL_FILE = None  # File with the host's SET_PROTOCOL value (0 boot, 1 report), if the gadget driver exposes one
+LED_PINS = {}  # Host LED bit (host_leds.LED_*) to the GPIO driving that LED
+LATENCY_FILE = "/home/pi/KeyLimePi/latency.txt"  # Written on SIGUSR1, None to turn latency stats off
+TELEMETRY_SOCKET = "/run/keylimepi.sock"  # Counters in Prometheus text format (see telemetry.py), or None
+RECORD_FILE = "/home/pi/KeyLimePi/scans.klr"  # Recent matrix scans written on SIGUSR2 (see recorder.py), or None. Kept off usbdisk.d, the host may have that mounted
+RECORD_CAPACITY = 65536  # Matrix changes kept for RECORD_FILE
 
 if __name__ == "__main__":
+    from latency import LatencyStats, StartupTimer
+    startup = StartupTimer()
+
     import time
-    import json
 
     import pigpio
     # import RPi.GPIO as GPIO
-    from PIL import ImageFont
-    from cheap_oled import OLED_SH1106, OLED_Canvas
 
+    from debounce import make_debounce
+    from display import StatusDisplay
+    from ghost import GhostFilter
+    from hid_protocol import ProtocolWatcher
+    from host_leds import LED_NAMES, HostLedReader
+    from keymap import load_keymap
+    from keymap_watch import KeymapWatcher
+    from recorder import RecordingMatrix, ScanRecorder
+    from scanner import Scanner
+    from selector import SelectorSwitch
     from shift_matrix_kb import ShiftRegisterMatrix
+    from telemetry import Telemetry, TelemetryServer
     from usb_kb_output import UsbKeyboardOutput
+    from usb_media_output import UsbMediaOutput
+    startup.mark("imports")
 
-    # Setup GPIO
-    pi = pigpio.pi()
+    # Setup GPIO, GpioMem has no SPI or scripts
+    if GPIO_DRIVER not in ("pigpio", "gpiomem"):
+        raise SystemExit(f'Unknown GPIO_DRIVER "{GPIO_DRIVER}", expected "pigpio" or "gpiomem"')
+    if GPIO_DRIVER == "gpiomem" and SCAN_MODE != "bitbang":
+        raise SystemExit(f'GPIO_DRIVER "gpiomem" only works with the "bitbang" SCAN_MODE, not "{SCAN_MODE}"')
+    if GPIO_DRIVER == "gpiomem":
+        from gpiomem import GpioMem
+        pi = GpioMem()
+    else:
+        pi = pigpio.pi()
     if not pi.connected:
         exit()
 
     # GPIO.setwarnings(False)
     # GPIO.setmode(GPIO.BCM)
 
-    font = ImageFont.truetype("/home/pi/KeyLimePi/keylimepy/oled/fonts/C&C Red Alert [INET].ttf", 24)
-    oled = OLED_SH1106(port=1, address=0x3C)
+    keyboard_matrix = ShiftRegisterMatrix(pi, mode=SCAN_MODE)
+    if RECORD_FILE:
+        recorder = ScanRecorder(ShiftRegisterMatrix.ROWS, ShiftRegisterMatrix.COLS, RECORD_CAPACITY)
+        recorder.flush_on_signal(RECORD_FILE)
+        keyboard_matrix = RecordingMatrix(keyboard_matrix, recorder)
+    startup.mark("matrix")
+
+    protocols = {"boot": UsbKeyboardOutput.PROTOCOL_BOOT, "nkro": UsbKeyboardOutput.PROTOCOL_REPORT}
+    usb_keyboard = UsbKeyboardOutput(protocol=protocols.get(HID_PROTOCOL, protocols[HID_PROTOCOL_FALLBACK]))
+    usb_media = UsbMediaOutput()
+    startup.mark("outputs")
+
+    # Load every profile's compiled keymap, or compile and cache it, so switching
+    # profiles never parses anything. Positions without a file use KEYMAP_FILE.
+    keymaps = {path: load_keymap(path, ShiftRegisterMatrix.COLS, KEYMAP_CACHE_DIR)
+               for path in {KEYMAP_FILE, *PROFILE_FILES.values()}}
+    selector = SelectorSwitch(pi, SELECTOR_PINS) if SELECTOR_PINS else None
+
+    def profile_file():
+        return PROFILE_FILES.get(selector.position, KEYMAP_FILE) if selector else KEYMAP_FILE
+
+    keymap = keymaps[profile_file()]
+    debounce = make_debounce(DEBOUNCE, DEBOUNCE_MS, SCAN_RATE)
+    ghost = GhostFilter(ShiftRegisterMatrix.ROWS, ShiftRegisterMatrix.COLS, GHOST_POLICY) if GHOST_POLICY else None
+    startup.mark("keymap")
+
+    latency = None
+    if LATENCY_FILE:
+        latency = LatencyStats()
+        latency.dump_on_signal(LATENCY_FILE)
+
+    # Typing works from here, everything after runs alongside the scan loop
+    scanner = Scanner(keyboard_matrix, keymap, debounce, usb_keyboard, rate=SCAN_RATE,
+                      idle_timeout=IDLE_TIMEOUT, idle_rate=IDLE_SCAN_RATE, cpu=SCAN_CPU, priority=SCAN_PRIORITY,
+                      latency=latency, media=usb_media, ghost=ghost)
+    scanner.start()
+    while scanner.scan_count == 0 and scanner.is_alive():
+        time.sleep(0.0001)
+    startup.mark("first scan")
+
+    # Keymap errors, lock states, the profile and the scan rate, drawn on the display's own thread
+    display = StatusDisplay(FONT_FILE, lines=("error", "leds", "profile", "rate"))
+    display.start()
+
+    def show_leds(leds):
+        display.set(leds=" ".join(name for bit, name in LED_NAMES if leds & bit))
+
+    HostLedReader(usb_keyboard.fileno(), pi, LED_PINS, show_leds).start()
+    if HID_PROTOCOL == "auto" and HID_PROTOCOL_FILE:
+        ProtocolWatcher(usb_keyboard, HID_PROTOCOL_FILE, protocols[HID_PROTOCOL_FALLBACK]).start()
 
-    with OLED_Canvas(oled) as draw: 
-        draw.rectangle((0, 0, oled.width, oled.height), outline=0, fill=0)
-        draw.text((0, 0), f"Initialzing", 255, font=font)
-        draw.text((0, 20), f"KeyLimePi", 255, font=font)
-        # draw.text((0, 40), f"", 255, font=font)
+    # Profile switches are a swap to an already compiled keymap, from pigpio's callback thread
+    def select_profile(position):
+        scanner.set_keymap(keymaps[profile_file()])
+        display.set(profile=f"Profile {position}")
 
-    keyboard_matrix = ShiftRegisterMatrix(pi)
-    usb_keyboard = UsbKeyboardOutput()
+    if selector:
+        selector.on_change = select_profile
+        display.set(profile=f"Profile {selector.position}")
 
-    # Load Keymap file
-    keymap_file = open(KEYMAP_FILE)
-    keyboard = json.load(keymap_file)
-    keymap = keyboard['keymap']
-    keymap_file.close()
+    # The old keymap stays in use if a changed file doesn't load
+    def keymap_loaded(path, keymap):
+        keymaps[path] = keymap
+        if path == profile_file():
+            scanner.set_keymap(keymap)
+        print(f"Reloaded {path}")
+        display.set(error="")
 
-    with OLED_Canvas(oled) as draw: 
-        draw.rectangle((0, 0, oled.width, oled.height), outline=0, fill=0)
+    def keymap_failed(path, error):
+        print(f"Keeping the current keymap, {path} failed to load: {error}")
+        display.set(error="Keymap error")
 
-    while True:
-        start_time = time.time()
+    if KEYMAP_RELOAD_INTERVAL:
+        for path in keymaps:
+            KeymapWatcher(path, ShiftRegisterMatrix.ROWS, ShiftRegisterMatrix.COLS,
+                          lambda keymap, path=path: keymap_loaded(path, keymap),
+                          lambda error, path=path: keymap_failed(path, error),
+                          KEYMAP_RELOAD_INTERVAL, KEYMAP_CACHE_DIR).start()
 
-        # Scan the keyboard matrix using shift registers
-        active_keys = keyboard_matrix.read(keymap)
+    if TELEMETRY_SOCKET:
+        telemetry = Telemetry()
+        telemetry.add_attr(scanner, "scan_count", "scans_total", "counter", "Matrix scans")
+        telemetry.add_attr(scanner, "scan_rate", "scan_rate", "gauge", "Scans per second over the last second")
+        telemetry.add_attr(scanner, "deadline_misses", "deadline_misses_total", "counter", "Scans started a whole period late")
+        telemetry.add_attr(scanner, "step_errors", "scan_errors_total", "counter", "Scans that raised an exception")
+        telemetry.add_attr(debounce, "rejections", "debounce_rejections_total", "counter", "Raw key changes thrown away as bounce")
+        telemetry.add_attr(keyboard_matrix.script, "timeouts", "script_scan_timeouts_total", "counter", "Script scans pigpiod didn't finish in time")
+        telemetry.add_attr(ghost, "ghost_count", "ghost_states_total", "counter", "Matrix states with an ambiguous key rectangle")
+        for name, output in (("hid", usb_keyboard), ("media", usb_media)):
+            telemetry.add_attr(output, "report_count", f"{name}_reports_total", "counter", "Reports written")
+            telemetry.add_rate(f"{name}_reports_per_second", "Reports written per second since the last read",
+                               lambda output=output: output.report_count)
+            telemetry.add_attr(output, "eagain_count", f"{name}_eagain_total", "counter", "Writes the host wasn't ready for")
+            telemetry.add_attr(output, "write_errors", f"{name}_write_errors_total", "counter", "Writes that failed")
+        if latency:
+            total = latency.stages["total"]
+            telemetry.add("report_latency_p99_seconds", "gauge", "99th percentile from scan start to report written",
+                          lambda: total.summary()[1][99] / 1e9)
+        TelemetryServer(telemetry, TELEMETRY_SOCKET).start()
 
-        # Write the key state to the usb
-        usb_keyboard.write_nkro(active_keys)
+    display.ready.wait(5)
+    startup.mark("display")
+    print(startup.format(), end="")
 
-        # print(time.time() - start_time)
-        time.sleep(max(0, (1/125) - (time.time() - start_time))) # ~125Hz
\ No newline at end of file
+    while scanner.is_alive():
+        scanner.join(STATS_INTERVAL)
+        print(f"{scanner.scan_rate:.0f} scans/s, {scanner.deadline_misses} deadline misses")
+        display.set(rate=f"{scanner.scan_rate:.0f} scans/s")
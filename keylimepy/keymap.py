@@ -0,0 +1,170 @@
+import hashlib
+import json
+import marshal
+import os
+import struct
+
+from usb_hid_scancodes import scancodes
+
+MOD_KEY_PREFIX = "KEY_MOD_"
+MOD_USAGE = 0xe0  # KEY_LEFTCTRL, modifier bit 0
+CHUNK_BITS = 8
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# Compiled keymap cache file: header, codes (rows * cols bytes), then the lookup tables
+# marshalled, which loads them in C about twice as fast as building them
+CACHE_MAGIC = b"KLK" + bytes((marshal.version,))
+CACHE_HEADER = struct.Struct("<4sHH")  # magic, rows, cols
+CACHE_SUFFIX = ".keymap"
+
+# HID usage of a key name, KEY_MOD_* names become the matching 0xe0-0xe7 usage
+def key_usage(key):
+    code = scancodes[key]
+    if key.startswith(MOD_KEY_PREFIX):
+        code = MOD_USAGE + code.bit_length() - 1
+    return code
+
+class CompiledKeymap:
+
+    '''
+    This class turns the "keymap" grid from a keymap JSON file into lookup tables, so the
+    scan loop never touches key names.
+
+    codes[row][col] is the HID usage of each key (KEY_MOD_* names become the matching
+    0xe0-0xe7 usage), as bytes per row.
+
+    resolve() turns a matrix state (bit row * cols + col set while the key is down) into
+    a usage bitmap (bit n set while usage n is down) with one table lookup per 8 bits of
+    matrix state. Modifiers are usages 0xe0-0xe7, so (usages >> 0xe0) & 0xff is the
+    modifier byte of a report.
+
+    '''
+
+    def __init__(self, keymap, cols):
+        codes = []
+        for i, row_keys in enumerate(keymap):
+            if len(row_keys) > cols:
+                raise ValueError(f"Keymap row {i} has {len(row_keys)} keys, the matrix only has {cols} columns")
+            row_codes = bytearray(cols)
+            for j, key in enumerate(row_keys):
+                row_codes[j] = self._usage(key, i, j)
+            codes.append(bytes(row_codes))
+
+        self._set_codes(codes, cols)
+        self._luts = self._build_luts()
+
+    def _set_codes(self, codes, cols):
+        self.rows = len(codes)
+        self.cols = cols
+        self.codes = tuple(codes)
+
+    # Writes the compiled tables for from_cache(), through a temporary file so a reader
+    # never sees half of one
+    def save_cache(self, path):
+        with open(path + ".tmp", "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, self.rows, self.cols))
+            f.write(b"".join(self.codes))
+            marshal.dump(self._luts, f)
+        os.replace(path + ".tmp", path)
+
+    # Loads tables written by save_cache() without compiling anything, raises ValueError
+    # if the file isn't one
+    @classmethod
+    def from_cache(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, rows, cols = CACHE_HEADER.unpack_from(data)
+        offset = CACHE_HEADER.size
+        if magic != CACHE_MAGIC:
+            raise ValueError(f"{path} isn't a compiled keymap")
+
+        keymap = cls.__new__(cls)
+        keymap._set_codes([data[offset + i * cols:offset + (i + 1) * cols] for i in range(rows)], cols)
+        keymap._luts = marshal.loads(data[offset + rows * cols:])
+        return keymap
+
+    pending = False  # Nothing to send without a key change, see layers.LayeredKeymap
+
+    # No state to clear, see layers.LayeredKeymap
+    def reset(self):
+        pass
+
+    @staticmethod
+    def _usage(key, row, col):
+        if key not in scancodes:
+            raise ValueError(f"Unknown key {key!r} at row {row}, column {col}")
+        return key_usage(key)
+
+    def _build_luts(self):
+        # Usage bit for every matrix bit, then OR them together for each possible chunk value
+        key_bits = []
+        for row_codes in self.codes:
+            key_bits += [1 << code if code else 0 for code in row_codes]
+
+        luts = []
+        for start in range(0, len(key_bits), CHUNK_BITS):
+            chunk_bits = key_bits[start:start + CHUNK_BITS]
+            chunk_bits += [0] * (CHUNK_BITS - len(chunk_bits))
+            lut = [0] * (1 << CHUNK_BITS)
+            for value in range(1, len(lut)):
+                low = value & -value
+                lut[value] = lut[value ^ low] | chunk_bits[low.bit_length() - 1]
+            luts.append(tuple(lut))
+        return tuple(luts)
+
+    # now is only used by layers.LayeredKeymap
+    def resolve(self, state, now=None):
+        usages = 0
+        for lut in self._luts:
+            if not state:
+                break
+            usages |= lut[state & CHUNK_MASK]
+            state >>= CHUNK_BITS
+        return usages
+
+
+# Keymaps with layers, macros or actions (see layers.LayeredKeymap) get the layer engine,
+# a plain grid of keys only needs the lookup tables.
+#
+# Given a cache_dir, a plain keymap's tables are cached there under a hash of the JSON,
+# so the next start with the same file skips parsing and compiling it.
+def load_keymap(path, cols, cache_dir=None):
+    with open(path, "rb") as keymap_file:
+        data = keymap_file.read()
+
+    cache_path = None
+    if cache_dir:
+        # One cached keymap per keymap file, named by hashes of its path and contents
+        source = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]
+        digest = hashlib.sha256(data + cols.to_bytes(2, 'little')).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f"{source}-{digest}{CACHE_SUFFIX}")
+        try:
+            return CompiledKeymap.from_cache(cache_path)
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            pass
+
+    keyboard = json.loads(data)
+    if "layers" in keyboard or "macros" in keyboard or any(
+            not isinstance(key, str) or "(" in key for row_keys in keyboard['keymap'] for key in row_keys):
+        from layers import LayeredKeymap
+        return LayeredKeymap.from_json(keyboard, cols)
+
+    keymap = CompiledKeymap(keyboard['keymap'], cols)
+    if cache_path:
+        _save_cache(keymap, cache_path)
+    return keymap
+
+
+# Replaces any older cached keymap of the same file, a failure only means the next start
+# compiles again
+def _save_cache(keymap, cache_path):
+    cache_dir, cache_name = os.path.split(cache_path)
+    source = cache_name.partition("-")[0]
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.startswith(source + "-") and name.endswith(CACHE_SUFFIX):
+                os.remove(os.path.join(cache_dir, name))
+        keymap.save_cache(cache_path)
+    except OSError:
+        pass
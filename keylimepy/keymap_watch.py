@@ -0,0 +1,62 @@
+import os
+import threading
+
+from keymap import load_keymap
+
+class KeymapWatcher(threading.Thread):
+
+    '''
+    This thread reloads the keymap file when it changes, so a keymap edited on the USB
+    disk takes effect without a restart.
+
+    It polls the file's mtime and size every interval seconds, a stat() off the scan
+    thread. A changed file is parsed and compiled here (and cached in cache_dir, see
+    keymap.load_keymap), then handed to on_load(keymap), e.g. Scanner.set_keymap. A file
+    that fails to load, or doesn't fit a matrix of rows x cols, goes to on_error(error)
+    instead and the current keymap stays in use. It's only tried again once the file
+    changes again, so a half written file is picked up when the write finishes.
+
+    '''
+
+    def __init__(self, path, rows, cols, on_load, on_error=None, interval=1, cache_dir=None):
+        super().__init__(name="keymap-watch", daemon=True)
+        self.path = path
+        self.rows = rows
+        self.cols = cols
+        self.on_load = on_load
+        self.on_error = on_error
+        self.interval = interval
+        self.cache_dir = cache_dir
+        self._stop_event = threading.Event()
+        self._signature = self._stat()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        keymap = load_keymap(self.path, self.cols, self.cache_dir)
+        if keymap.rows > self.rows:
+            raise ValueError(f"Keymap has {keymap.rows} rows, the matrix only has {self.rows}")
+        return keymap
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            try:
+                keymap = self.load()
+            except Exception as e:
+                # Anything wrong with the file, the watcher has to outlive it
+                if self.on_error is not None:
+                    self.on_error(e)
+                continue
+            self.on_load(keymap)
@@ -0,0 +1,127 @@
+import os
+import signal
+import time
+from array import array
+
+class Histogram:
+
+    '''
+    Fixed bucket histogram of ns durations.
+
+    Values under 16 get a bucket each, above that every power of two is split into 8
+    buckets, so any value lands in a bucket within 12.5% of it. record() is a few integer
+    operations and one array increment. Only the scan thread records, so readers just
+    copy the counts without locking.
+
+    '''
+
+    SUB_BITS = 3
+    NUM_BUCKETS = 320
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * self.NUM_BUCKETS))
+        self.max = 0
+
+    def record(self, ns):
+        e = ns.bit_length()
+        if e > self.SUB_BITS + 1:
+            i = (e - self.SUB_BITS - 1 << self.SUB_BITS) + (ns >> e - self.SUB_BITS - 1)
+            if i >= self.NUM_BUCKETS:
+                i = self.NUM_BUCKETS - 1
+        else:
+            i = ns
+        self.counts[i] += 1
+        if ns > self.max:
+            self.max = ns
+
+    @classmethod
+    def bucket_value(cls, i):
+        if i < 2 << cls.SUB_BITS:
+            return i
+        e = (i >> cls.SUB_BITS) - 1
+        return ((1 << cls.SUB_BITS) | (i & (1 << cls.SUB_BITS) - 1)) << e
+
+    # Returns (count, {percentile: ns}, max) from a copy of the counts
+    def summary(self, percentiles=(50, 99)):
+        counts = list(self.counts)
+        total = sum(counts)
+        values = {}
+        for p in percentiles:
+            target = total * p / 100
+            seen = 0
+            for i, count in enumerate(counts):
+                seen += count
+                if count and seen >= target:
+                    values[p] = self.bucket_value(i)
+                    break
+            else:
+                values[p] = 0
+        return total, values, self.max
+
+
+class LatencyStats:
+
+    '''
+    One Histogram per pipeline stage, see scanner.Scanner for the stages recorded.
+
+    '''
+
+    STAGES = ("scan", "debounce", "keymap", "report", "write", "total")
+
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in self.STAGES}
+
+    def format(self):
+        lines = [f"{'stage':<10}{'count':>10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}"]
+        for stage, histogram in self.stages.items():
+            count, values, max_ns = histogram.summary()
+            lines.append(f"{stage:<10}{count:>10}{values[50] / 1000:>10.1f}{values[99] / 1000:>10.1f}{max_ns / 1000:>10.1f}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        with open(path, 'w') as dump_file:
+            dump_file.write(self.format())
+
+    # Dumps the stats to path whenever the process gets SIGUSR1, e.g. `pkill -USR1 -f keylimepy`
+    def dump_on_signal(self, path, signum=signal.SIGUSR1):
+        signal.signal(signum, lambda *_: self.dump(path))
+
+
+class StartupTimer:
+
+    '''
+    Times the steps of starting up. mark() after each step, format() lists how long each
+    took and the total since the timer was made, the process started and the Pi booted.
+
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter_ns()
+        self.marks = []
+
+    def mark(self, step):
+        self.marks.append((step, time.perf_counter_ns()))
+
+    # Seconds since the process started, from /proc (Linux only), or None
+    @staticmethod
+    def process_age():
+        try:
+            with open("/proc/self/stat") as stat_file:
+                # Field 22, counted after the parenthesised command name
+                start_ticks = int(stat_file.read().rpartition(")")[2].split()[19])
+            return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError, AttributeError):
+            return None
+
+    def format(self):
+        lines = [f"{'step':<16}{'ms':>10}{'total ms':>10}"]
+        last = self.start
+        for step, t in self.marks:
+            lines.append(f"{step:<16}{(t - last) / 1e6:>10.1f}{(t - self.start) / 1e6:>10.1f}")
+            last = t
+        process_age = self.process_age()
+        if process_age is not None:
+            lines.append(f"{process_age * 1000:.0f} ms since the process started")
+        if hasattr(time, "CLOCK_BOOTTIME"):
+            lines.append(f"{time.clock_gettime(time.CLOCK_BOOTTIME):.1f} s since boot")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,293 @@
+import re
+import time
+from collections import deque
+
+from keymap import CompiledKeymap, key_usage
+from usb_hid_scancodes import scancodes
+
+TRANSPARENT = "KEY_TRNS"
+ACTION_RE = re.compile(r"^(\w+)\((.*)\)$")
+
+# Action kinds
+MO, TG, OSM, TH, MACRO = range(5)
+
+class LayeredKeymap:
+
+    '''
+    This class adds layers, tap-hold keys, one-shot modifiers and macros on top of the
+    CompiledKeymap lookup tables.
+
+    Keymap JSON:
+
+        "keymap": [[...]],                 the base layer
+        "layers": {"fn": [[...]], ...},    stacked in order above the base layer
+        "macros": {"hi": ["KEY_MOD_LSHIFT+KEY_H", "KEY_I"], ...},
+        "tapping_term_ms": 200
+
+    Besides key names, a layer grid can hold:
+
+        "KEY_TRNS" or null          transparent, the key from the next active layer down
+        "MO(fn)"                    layer fn while held
+        "TG(fn)"                    toggles layer fn
+        "OSM(KEY_MOD_LSHIFT)"       one-shot modifier, a tap applies it to the next key
+        "TH(KEY_ESC,KEY_MOD_LCTRL)" KEY_ESC on tap, KEY_MOD_LCTRL on hold (or "MO(fn)")
+        "M(hi)"                     types macro hi, one step per scan, each step released
+                                    before the next
+
+    Every layer is compiled to its own lookup tables with actions and transparent keys as
+    KEY_NONE, plus a mask of the keys it defines and a mask of its action keys. A key
+    belongs to the highest active layer that defines it when it goes down, and stays on
+    that layer until it's released. Picking the layer for every key pressed in a scan is
+    a bitmask per active layer, the usages are a table lookup per layer with keys down.
+    Only action keys go through the state machine.
+
+    A tap-hold key becomes a hold once another key goes down or after the tapping term
+    on the scanner's clock, so plain keys are never held back waiting on it. While a tap
+    is waiting to be decided or a tap/macro still has reports to send, pending is True so
+    the scanner keeps resolving without a matrix change.
+
+    '''
+
+    TAPPING_TERM_MS = 200
+
+    def __init__(self, layers, cols, names=(), macros=None, tapping_term_ms=TAPPING_TERM_MS):
+        self._layer_index = {name: i for i, name in enumerate(names, 1)}
+        self._macros = {name: tuple(self._chord(step) for step in steps) for name, steps in (macros or {}).items()}
+        self._tapping_term_ns = int(tapping_term_ms * 1000000)
+
+        self.num_layers = len(layers)
+        self._keymaps = []
+        self._defined = []  # Matrix bits each layer defines
+        self._action_masks = []
+        self._actions = []  # Matrix bit to action, per layer
+        for layer, grid in enumerate(layers):
+            keys = []
+            defined = 0
+            action_mask = 0
+            actions = {}
+            for i, row_keys in enumerate(grid):
+                row = []
+                for j, key in enumerate(row_keys):
+                    bit = 1 << (i * cols + j)
+                    if key is None or key == TRANSPARENT:
+                        row.append("KEY_NONE")
+                        continue
+                    defined |= bit
+                    match = ACTION_RE.match(key)
+                    if match:
+                        actions[bit] = self._action(match, i, j)
+                        action_mask |= bit
+                        row.append("KEY_NONE")
+                    else:
+                        row.append(key)
+                keys.append(row)
+            self._keymaps.append(CompiledKeymap(keys, cols))
+            self._defined.append(defined)
+            self._action_masks.append(action_mask)
+            self._actions.append(actions)
+
+        base = self._keymaps[0]
+        self.rows = base.rows
+        self.cols = cols
+        self.codes = base.codes
+        # Keys outside the base grid still belong to the base layer
+        self._defined[0] = (1 << (max(len(keymap.codes) for keymap in self._keymaps) * cols)) - 1
+
+        self.reset()
+
+    @classmethod
+    def from_json(cls, keyboard, cols):
+        layers = keyboard.get("layers", {})
+        macros = keyboard.get("macros", {})
+        tapping_term_ms = keyboard.get("tapping_term_ms", cls.TAPPING_TERM_MS)
+        if not isinstance(layers, dict):
+            raise ValueError(f"\"layers\" must map layer names to grids, not {type(layers).__name__}")
+        if not isinstance(macros, dict):
+            raise ValueError(f"\"macros\" must map macro names to lists of keys, not {type(macros).__name__}")
+        if isinstance(tapping_term_ms, bool) or not isinstance(tapping_term_ms, (int, float)):
+            raise ValueError(f"\"tapping_term_ms\" must be a number, not {tapping_term_ms!r}")
+        return cls([keyboard["keymap"], *layers.values()], cols, tuple(layers), macros, tapping_term_ms)
+
+    def reset(self):
+        self.layer_mask = 1  # Bit n set while layer n is active
+        self._toggled = 0
+        self._momentary = [0] * self.num_layers  # Held MO keys per layer
+        self._latched = [0] * self.num_layers  # Matrix bits down on each layer
+        self._state = 0
+        self._held = {}  # Matrix bit to the action of a held action key
+        self._held_usages = {}  # Matrix bit to the usages a held action key sends
+        self._held_bits = 0
+        self._taps = {}  # Matrix bit to the press time of an undecided tap-hold key
+        self._clean_osm = 0  # One-shot keys held with nothing else pressed since
+        self._oneshot = 0
+        self._oneshot_used = False
+        self._frames = deque()  # Usages to send for the next scans (taps and macros)
+        self.pending = False
+
+    @staticmethod
+    def _chord(keys):
+        usages = 0
+        for key in keys.split("+"):
+            if key not in scancodes:
+                raise ValueError(f"Unknown key {key!r} in macro")
+            usages |= 1 << key_usage(key)
+        return usages
+
+    def _layer(self, name, row, col):
+        if name not in self._layer_index:
+            raise ValueError(f"Unknown layer {name!r} at row {row}, column {col}")
+        return self._layer_index[name]
+
+    def _key(self, key, row, col):
+        if key not in scancodes:
+            raise ValueError(f"Unknown key {key!r} at row {row}, column {col}")
+        return 1 << key_usage(key)
+
+    def _action(self, match, row, col):
+        kind, arg = match.group(1), match.group(2).strip()
+        if kind == "MO":
+            return MO, self._layer(arg, row, col)
+        if kind == "TG":
+            return TG, self._layer(arg, row, col)
+        if kind == "OSM":
+            return OSM, self._key(arg, row, col)
+        if kind == "M":
+            if arg not in self._macros:
+                raise ValueError(f"Unknown macro {arg!r} at row {row}, column {col}")
+            return MACRO, self._macros[arg]
+        if kind == "TH":
+            tap, _, hold = (part.strip() for part in arg.partition(","))
+            match = ACTION_RE.match(hold)
+            if match and match.group(1) == "MO":
+                hold_action = MO, self._layer(match.group(2).strip(), row, col)
+            else:
+                hold_action = None, self._key(hold, row, col)
+            return TH, self._key(tap, row, col), hold_action
+        raise ValueError(f"Unknown action {match.group(0)!r} at row {row}, column {col}")
+
+    def _update_layers(self):
+        mask = 1 | self._toggled
+        for layer, count in enumerate(self._momentary):
+            if count:
+                mask |= 1 << layer
+        self.layer_mask = mask
+
+    def _hold(self, bit, action):
+        kind, arg = action[0], action[1]
+        if kind == MO:
+            self._momentary[arg] += 1
+            self._update_layers()
+        else:
+            self._held_usages[bit] = arg
+        self._held[bit] = action
+
+    def _press(self, pressed, now):
+        # Any key going down decides the waiting tap-holds as holds, and spoils one-shots
+        for bit in self._taps:
+            self._hold(bit, self._held[bit][2])
+        self._taps.clear()
+        self._clean_osm = 0
+
+        remaining = pressed
+        for layer in range(self.num_layers - 1, -1, -1):
+            if not self.layer_mask >> layer & 1:
+                continue
+            take = remaining & self._defined[layer]
+            if not take:
+                continue
+            self._latched[layer] |= take
+            remaining ^= take
+
+            actions = take & self._action_masks[layer]
+            take ^= actions
+            if take and self._oneshot:
+                self._oneshot_used = True
+            while actions:
+                bit = actions & -actions
+                actions ^= bit
+                self._press_action(bit, self._actions[layer][bit], now)
+            if not remaining:
+                break
+
+    def _press_action(self, bit, action, now):
+        kind = action[0]
+        if kind == TG:
+            self._toggled ^= 1 << action[1]
+            self._update_layers()
+        elif kind == OSM:
+            self._clean_osm |= bit
+            self._hold(bit, action)
+        elif kind == TH:
+            self._taps[bit] = now
+            self._held[bit] = action
+        elif kind == MACRO:
+            for step in action[1]:
+                self._frames.append(step)
+                self._frames.append(0)
+        else:
+            self._hold(bit, action)
+        self._held_bits |= bit
+
+    def _release(self, released, now):
+        for layer in range(self.num_layers):
+            self._latched[layer] &= ~released
+
+        bits = released & self._held_bits
+        self._held_bits ^= bits
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            action = self._held.pop(bit, None)
+            self._held_usages.pop(bit, None)
+            if action is None:
+                continue
+            kind = action[0]
+            if kind == MO:
+                self._momentary[action[1]] -= 1
+                self._update_layers()
+            elif kind == OSM:
+                if self._clean_osm & bit:
+                    self._oneshot |= action[1]
+                self._clean_osm &= ~bit
+            elif kind == TH:
+                # Still waiting, so it was a tap
+                del self._taps[bit]
+                self._frames.append(action[1])
+
+    # state is the debounced matrix state, now the scanner's perf_counter_ns() clock
+    def resolve(self, state, now=None):
+        if now is None:
+            now = time.perf_counter_ns()
+        changed = state ^ self._state
+        if changed:
+            self._state = state
+            released = changed & ~state
+            if released:
+                self._release(released, now)
+            pressed = changed & state
+            if pressed:
+                self._press(pressed, now)
+
+        if self._taps:
+            for bit, start in list(self._taps.items()):
+                if now - start >= self._tapping_term_ns:
+                    del self._taps[bit]
+                    self._hold(bit, self._held[bit][2])
+
+        usages = self._oneshot
+        if self._oneshot_used:
+            # Sent with the key it applies to, then cleared
+            self._oneshot = 0
+            self._oneshot_used = False
+        for layer, latched in enumerate(self._latched):
+            if latched:
+                usages |= self._keymaps[layer].resolve(latched)
+        for held in self._held_usages.values():
+            usages |= held
+
+        sent_frame = bool(self._frames)
+        if sent_frame:
+            usages |= self._frames.popleft()
+        # One more resolve after the last frame, so its keys are released
+        self.pending = bool(self._taps or self._frames or sent_frame)
+        return usages
@@ -0,0 +1,19 @@
+class MatrixState:
+
+    '''
+    This class keeps the last matrix state (bit row * cols + col set while the key is down)
+    and diffs every new scan against it.
+
+    update() returns the XOR of the new and previous state, which is 0 while no key
+    changes, so everything after it only has to run when it is non-zero.
+
+    '''
+
+    def __init__(self):
+        self.state = 0
+
+    def update(self, state):
+        changed = state ^ self.state
+        if changed:
+            self.state = state
+        return changed
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+# Records raw matrix scans on the Pi and replays them through the pipeline anywhere.
+# Replay a recording from this directory with:
+#
+#   python recorder.py /path/to/scans.klr --debounce eager --dump
+
+import argparse
+import os
+import signal
+import struct
+import time
+
+from scanner import Scanner
+from usb_kb_output import UsbKeyboardOutput
+
+# Recording file: header, then records of a TIME timestamp (perf_counter_ns) followed by
+# the matrix state as little endian bytes, oldest first
+RECORD_MAGIC = b"KLR1"
+RECORD_HEADER = struct.Struct("<4sHH")  # magic, rows, cols
+TIME = struct.Struct("<Q")
+
+
+class ScanRecorder:
+
+    '''
+    This class keeps the last capacity matrix states, with the time each one was first
+    scanned, in a preallocated ring buffer of fixed size records. Recording one is a
+    struct.pack_into and a slice copy, and RecordingMatrix only records changes.
+
+    flush() writes the buffer out, so a recording can be pulled off the keyboard after
+    something went wrong. Not to the USB disk image while the host has it mounted, two
+    writers would corrupt it.
+
+    '''
+
+    def __init__(self, rows, cols, capacity=65536):
+        self.rows = rows
+        self.cols = cols
+        self.capacity = capacity
+        self.state_bytes = (rows * cols + 7) // 8
+        self.record_size = TIME.size + self.state_bytes
+        self._buffer = bytearray(capacity * self.record_size)
+        self._next = 0  # Record to write next
+        self.count = 0  # Records in the buffer
+
+    def record(self, t_ns, state):
+        offset = self._next * self.record_size
+        TIME.pack_into(self._buffer, offset, t_ns)
+        self._buffer[offset + TIME.size:offset + self.record_size] = state.to_bytes(self.state_bytes, 'little')
+        self._next += 1
+        if self._next == self.capacity:
+            self._next = 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    # The records oldest first
+    def records_bytes(self):
+        count, start = self.count, self._next
+        data = bytes(self._buffer)
+        if count < self.capacity:
+            return data[:count * self.record_size]
+        start *= self.record_size
+        return data[start:] + data[:start]
+
+    # Writes the recording through a temporary file, so a reader never sees half of one
+    def flush(self, path):
+        with open(path + ".tmp", "wb") as record_file:
+            record_file.write(RECORD_HEADER.pack(RECORD_MAGIC, self.rows, self.cols))
+            record_file.write(self.records_bytes())
+            record_file.flush()
+            os.fsync(record_file.fileno())
+        os.replace(path + ".tmp", path)
+
+    # Flushes the recording to path whenever the process gets SIGUSR2, e.g. `pkill -USR2 -f keylimepy`
+    def flush_on_signal(self, path, signum=signal.SIGUSR2):
+        signal.signal(signum, lambda *_: self.flush(path))
+
+
+# Returns (rows, cols, [(t_ns, state), ...]) from a file written by ScanRecorder.flush()
+def load_recording(path):
+    with open(path, "rb") as record_file:
+        data = record_file.read()
+    magic, rows, cols = RECORD_HEADER.unpack_from(data)
+    if magic != RECORD_MAGIC:
+        raise ValueError(f"{path} isn't a scan recording")
+    state_bytes = (rows * cols + 7) // 8
+    record_size = TIME.size + state_bytes
+    records = []
+    for offset in range(RECORD_HEADER.size, len(data) - record_size + 1, record_size):
+        t_ns, = TIME.unpack_from(data, offset)
+        records.append((t_ns, int.from_bytes(data[offset + TIME.size:offset + record_size], 'little')))
+    return rows, cols, records
+
+
+class RecordingMatrix:
+
+    '''
+    Wraps a matrix, recording every scan that differs from the one before into a
+    ScanRecorder. Everything else is passed through to the matrix.
+
+    '''
+
+    def __init__(self, matrix, recorder):
+        self._matrix = matrix
+        self._recorder = recorder
+        self._last = None
+
+    def __getattr__(self, name):
+        return getattr(self._matrix, name)
+
+    def scan(self):
+        state = self._matrix.scan()
+        if state != self._last:
+            self._last = state
+            self._recorder.record(time.perf_counter_ns(), state)
+        return state
+
+
+class ReplayMatrix:
+
+    '''
+    A matrix that plays back recorded states, scan() returns the state recorded at or
+    before now, which the replay sets before every scan.
+
+    '''
+
+    can_idle = False
+
+    def __init__(self, records):
+        self._records = records
+        self._i = 0
+        self._state = 0
+        self.now = 0
+
+    def scan(self):
+        records = self._records
+        while self._i < len(records) and records[self._i][0] <= self.now:
+            self._state = records[self._i][1]
+            self._i += 1
+        return self._state
+
+
+class ReplayOutput(UsbKeyboardOutput):
+
+    '''
+    UsbKeyboardOutput writing to /dev/null, keeping (now, report) for every report that
+    was written, now being the replay's clock.
+
+    '''
+
+    def __init__(self, protocol=UsbKeyboardOutput.PROTOCOL_REPORT):
+        super().__init__(os.devnull, protocol, os.devnull)
+        self.now = 0
+        self.reports = []
+
+    def write_report(self, report):
+        written = super().write_report(report)
+        if written:
+            self.reports.append((self.now, bytes(report)))
+        return written
+
+
+# Feeds records through Scanner.step() on a simulated clock, scanning at rate from the
+# first record until tail_ms after the last, as fast as it can run. Returns the number
+# of scans.
+def replay(records, keymap, debounce, output, rate=1000, tail_ms=500, media=None, ghost=None):
+    matrix = ReplayMatrix(records)
+    scanner = Scanner(matrix, keymap, debounce, output, rate=rate, media=media, ghost=ghost)
+    if not records:
+        return 0
+
+    period = 1000000000 // rate
+    now = records[0][0]
+    end = records[-1][0] + tail_ms * 1000000
+    scans = 0
+    while now <= end:
+        matrix.now = output.now = now
+        scanner.step(now)
+        now += period
+        scans += 1
+    return scans
+
+
+if __name__ == "__main__":
+    from debounce import DEBOUNCE_MODES, make_debounce
+    from ghost import GHOST_POLICIES, GhostFilter
+    from keymap import load_keymap
+
+    parser = argparse.ArgumentParser(description="Replay a KeyLimePi scan recording through the pipeline")
+    parser.add_argument("recording")
+    parser.add_argument("--keymap", default="../keyboards/Corsair/Vengeance K65/default_keymap.json")
+    parser.add_argument("--rate", type=int, default=1000)
+    parser.add_argument("--debounce", default="eager", choices=DEBOUNCE_MODES)
+    parser.add_argument("--debounce-ms", type=float, default=5)
+    parser.add_argument("--ghost", choices=GHOST_POLICIES)
+    parser.add_argument("--dump", action="store_true", help="print every report written")
+    args = parser.parse_args()
+
+    rows, cols, records = load_recording(args.recording)
+    keymap = load_keymap(args.keymap, cols)
+    debounce = make_debounce(args.debounce, args.debounce_ms, args.rate)
+    ghost = GhostFilter(rows, cols, args.ghost) if args.ghost else None
+    output = ReplayOutput()
+
+    start = time.perf_counter()
+    scans = replay(records, keymap, debounce, output, args.rate, ghost=ghost)
+    elapsed = time.perf_counter() - start
+
+    if args.dump:
+        first = records[0][0] if records else 0
+        for t_ns, report in output.reports:
+            print(f"{(t_ns - first) / 1e6:>12.3f} ms  {report.hex()}")
+    simulated = scans / args.rate
+    print(f"{len(records)} records, {scans} scans, {len(output.reports)} reports, "
+          f"{simulated:.2f} s replayed in {elapsed:.2f} s ({simulated / elapsed if elapsed else 0:.0f}x real time)")
@@ -0,0 +1,229 @@
+import gc
+import os
+import threading
+import time
+
+from matrix_state import MatrixState
+
+class Scanner(threading.Thread):
+
+    '''
+    This thread runs the scan -> debounce -> report pipeline at a fixed rate.
+
+    Scans are scheduled on absolute perf_counter_ns() deadlines, so time spent scanning
+    doesn't add up into drift. If a scan starts a whole period late it counts as a
+    deadline miss and the schedule restarts from now rather than bursting to catch up.
+
+    The thread can be pinned to a CPU and given SCHED_FIFO priority, which needs root and
+    is skipped otherwise. Automatic garbage collection is turned off while it runs, and
+    only collects when going idle or every gc_interval seconds while no key is down, so
+    a collection never lands in the middle of typing.
+
+    After idle_timeout with no keys down, a matrix that can wait for a key press
+    (matrix.can_idle) does, and any other is only scanned at idle_rate until a key is seen.
+
+    A scan that raises (e.g. a pigpio.error) is counted in step_errors and the thread
+    keeps scanning, the report is sent again on the next scan. Errors are printed at
+    most once every ERROR_LOG_INTERVAL seconds.
+
+    Given a ghost.GhostFilter, scans that change the keys are checked for ghosting before
+    the keymap lookup.
+
+    Media keys go to media, a usb_media_output.UsbMediaOutput, if there is one.
+
+    Given a latency.LatencyStats, every scan records the time spent in the scan and
+    debounce stages, and every scan that changes the keys also records the keymap lookup,
+    report build, device write and the total from the start of that scan to the end of
+    the write. Without one the untimed step is used, so there is no cost at all.
+
+    '''
+
+    ERROR_LOG_INTERVAL = 10  # s
+
+    def __init__(self, matrix, keymap, debounce, output, rate=1000, idle_timeout=2,
+                 idle_rate=100, cpu=None, priority=None, gc_interval=10, latency=None, media=None,
+                 ghost=None):
+        super().__init__(name="scanner", daemon=True)
+        self.matrix = matrix
+        self.keymap = keymap
+        self._next_keymap = keymap  # Swapped in by the scan thread, see set_keymap()
+        self.debounce = debounce
+        self.output = output
+        self.media = media
+        self.ghost = ghost
+        self.matrix_state = MatrixState()
+
+        self._period_ns = 1000000000 // rate
+        self._idle_period_ns = max(1000000000 // idle_rate, self._period_ns)
+        self._idle_timeout_ns = int(idle_timeout * 1000000000)
+        self._gc_interval_ns = int(gc_interval * 1000000000)
+        self._cpu = cpu
+        self._priority = priority
+        self._running = False
+        self.latency = latency
+        if latency is not None:
+            self.step = self._step_timed
+
+        self.scan_count = 0
+        self.scan_rate = 0.0  # Scans per second, over the last second
+        self.deadline_misses = 0
+        self.step_errors = 0
+        self._last_error_log = None
+
+    def stop(self):
+        self._running = False
+
+    # Asks for a new keymap from another thread, one attribute store. The scan thread
+    # swaps it in between scans (_swap_keymap), so a keymap is only ever touched by the
+    # thread resolving it.
+    def set_keymap(self, keymap):
+        self._next_keymap = keymap
+
+    # A keymap used before (a profile switched back to) starts over with no layers or
+    # taps held. The output is marked pending so the keys already down are sent again
+    # through the new keymap on this scan, that one write (or identical report) clears it.
+    def _swap_keymap(self):
+        keymap = self._next_keymap
+        keymap.reset()
+        self.keymap = keymap
+        self.output.pending = True
+
+    def _setup_realtime(self):
+        if self._cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self._cpu})
+            except OSError as e:
+                print(f"Couldn't pin scanner to CPU {self._cpu}: {e}")
+        if self._priority:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self._priority))
+            except OSError as e:
+                print(f"Couldn't set scanner priority: {e}")
+
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+
+    def run(self):
+        self._setup_realtime()
+        self._running = True
+
+        matrix = self.matrix
+        period = active_period = self._period_ns
+        idle_period = self._idle_period_ns
+        idle_timeout = self._idle_timeout_ns
+        gc_interval = self._gc_interval_ns
+        perf_counter_ns = time.perf_counter_ns
+        sleep = time.sleep
+
+        now = perf_counter_ns()
+        deadline = now
+        last_active = now
+        last_gc = now
+        rate_start = now
+        rate_count = 0
+
+        try:
+            while self._running:
+                now = perf_counter_ns()
+                if now - deadline >= period:
+                    self.deadline_misses += 1
+                    deadline = now
+
+                try:
+                    if self.step(now):
+                        last_active = now
+                        period = active_period
+                    elif now - last_active > idle_timeout and matrix.can_idle:
+                        gc.collect()
+                        matrix.wait_for_key()
+                        now = last_active = last_gc = deadline = perf_counter_ns()
+                    elif now - last_active > idle_timeout and period != idle_period:
+                        gc.collect()
+                        last_gc = now
+                        period = idle_period
+                    elif now - last_gc > gc_interval:
+                        gc.collect()
+                        last_gc = now
+                except Exception as e:
+                    self._step_failed(e, now)
+
+                self.scan_count += 1
+                rate_count += 1
+                if now - rate_start >= 1000000000:
+                    self.scan_rate = rate_count * 1000000000 / (now - rate_start)
+                    rate_start = now
+                    rate_count = 0
+
+                deadline += period
+                delay = deadline - perf_counter_ns()
+                if delay > 0:
+                    sleep(delay / 1000000000)
+        finally:
+            gc.enable()
+
+    # Whatever the failed scan didn't send goes out on the next one
+    def _step_failed(self, error, now):
+        self.step_errors += 1
+        self.output.pending = True
+        if self._last_error_log is None or now - self._last_error_log >= self.ERROR_LOG_INTERVAL * 1000000000:
+            print(f"Scan failed: {error!r} ({self.step_errors} errors so far)")
+            self._last_error_log = now
+
+    # Scans once and writes a report if anything changed, returns True while a key is down
+    def step(self, now):
+        if self._next_keymap is not self.keymap:
+            self._swap_keymap()
+        raw_state = self.matrix.scan()
+        state = self.debounce.update(raw_state, now)
+
+        if self.matrix_state.update(state) or self._pending():
+            ghost = self.ghost
+            if ghost is not None:
+                state = ghost.filter(state)
+            usages = self.keymap.resolve(state, now)
+            if ghost is not None:
+                usages |= ghost.rollover_usages
+            self.output.write(usages)
+            if self.media is not None:
+                self.media.write(usages)
+        return bool(raw_state or state or self.keymap.pending)
+
+    # Reports still to send without a matrix change: a retry after EAGAIN, or a tap or
+    # macro from the keymap
+    def _pending(self):
+        return self.output.pending or self.keymap.pending or (self.media is not None and self.media.pending)
+
+    def _step_timed(self, now):
+        perf_counter_ns = time.perf_counter_ns
+        stages = self.latency.stages
+
+        if self._next_keymap is not self.keymap:
+            self._swap_keymap()
+        raw_state = self.matrix.scan()
+        t_scan = perf_counter_ns()
+        state = self.debounce.update(raw_state, now)
+        t_debounce = perf_counter_ns()
+        stages["scan"].record(t_scan - now)
+        stages["debounce"].record(t_debounce - t_scan)
+
+        if self.matrix_state.update(state) or self._pending():
+            t_start = perf_counter_ns()
+            ghost = self.ghost
+            if ghost is not None:
+                state = ghost.filter(state)
+            usages = self.keymap.resolve(state, now)
+            if ghost is not None:
+                usages |= ghost.rollover_usages
+            t_keymap = perf_counter_ns()
+            report = self.output.build(usages)
+            t_report = perf_counter_ns()
+            self.output.write_report(report)
+            if self.media is not None:
+                self.media.write(usages)
+            t_write = perf_counter_ns()
+            stages["keymap"].record(t_keymap - t_start)
+            stages["report"].record(t_report - t_keymap)
+            stages["write"].record(t_write - t_report)
+            stages["total"].record(t_write - now)
+        return bool(raw_state or state or self.keymap.pending)
@@ -1,15 +1,66 @@
+import threading
+
 import pigpio
 
 class SelectorSwitch:
-    def __init__(self, pi, pins):
+
+    '''
+    This class reads a selector switch wired to GPIOs, bit i of the position is pins[i].
+
+    The position is read from one bank read. With a pigpio.pi, every pin also gets an edge
+    callback behind a glitch filter, so a move is seen when it settles instead of by
+    polling, and on_change(position) is called from pigpio's callback thread. Without
+    callbacks (gpiomem.GpioMem) a thread of its own reads it every POLL_INTERVAL seconds,
+    and takes a new position once two reads in a row agree.
+
+    '''
+
+    SETTLE_US = 5000  # Contacts must be steady this long before an edge is reported
+    POLL_INTERVAL = 0.05  # s between reads without callbacks
+
+    def __init__(self, pi, pins, on_change=None):
         self._pi = pi
         self._pins = pins
+        self.on_change = on_change
 
         for pin in pins:
             pi.set_mode(pin, pigpio.INPUT)
+        self.position = self.read()
+
+        self._callbacks = []
+        self._stop_event = threading.Event()
+        if hasattr(pi, "callback"):
+            for pin in pins:
+                pi.set_glitch_filter(pin, self.SETTLE_US)
+                self._callbacks.append(pi.callback(pin, pigpio.EITHER_EDGE, self._edge))
+        else:
+            threading.Thread(target=self._poll, name="selector", daemon=True).start()
+
+    def close(self):
+        for callback in self._callbacks:
+            callback.cancel()
+        self._stop_event.set()
 
     def read(self):
+        bank = self._pi.read_bank_1()
         val = 0
         for i, pin in enumerate(self._pins):
-            val |= self._pi.read(pin) << i
-        return val
\ No newline at end of file
+            val |= (bank >> pin & 1) << i
+        return val
+
+    def _edge(self, gpio, level, tick):
+        self._changed(self.read())
+
+    def _poll(self):
+        last = self.position
+        while not self._stop_event.wait(self.POLL_INTERVAL):
+            position = self.read()
+            if position == last:
+                self._changed(position)
+            last = position
+
+    def _changed(self, position):
+        if position != self.position:
+            self.position = position
+            if self.on_change is not None:
+                self.on_change(position)
@@ -1,40 +1,93 @@
+import time
+
+from key_wake import KeyWake
 from shiftreg_pigpio import InputShiftReg, OutputShiftReg
+from shiftreg_script import ScriptShiftReg
+from shiftreg_spi import SpiShiftReg
 
 class ShiftRegisterMatrix:
-    def __init__(self, pi):
+    ROWS = 8
+    COLS = 16
+
+    OUT_PINS = (16, 20, 21)  # SER, RCLK, SRCLK
+    IN_PINS = (9, 25, 11)  # QH, SH/LD, CLK
+    WAKE_PINS = ()  # GPIO(s) wired to the OR of every column, leave empty if there isn't one
+
+    # Chips in each chain, one bit per row or column
+    OUT_CHIPS = (ROWS + 7) // 8
+    IN_CHIPS = (COLS + 7) // 8
+
+    # Scan modes:
+    #   "bitbang" clocks every bit with its own pigpiod call
+    #   "spi" uses the hardware SPI, one transfer per row
+    #   "script" runs the whole scan as a pigpio script inside the daemon
+    def __init__(self, pi, mode="bitbang"):
         self._pi = pi
-        self.shift_out = OutputShiftReg(pi, 16, 20, 21)
-        self.shift_in = InputShiftReg(pi, SH_LD=25, chips=2)
-
-    def read(self, rows, cols):
-        for i in range(rows):
-            self.shift_out.write(1 << i)
-            row_state = self.shift_in.read()
-            for j in range(len(row_state)):
-                print(f"{i:02d}:{j:02d} -> {row_state[j]}")
-        self.shift_out.write(0)
-
-    # def read(self, keymap):
-    #     for i, row_keys in enumerate(keymap):
-    #         self.shift_out.write(1 << i)
-    #         row_state = self.shift_in.read()
-    #         for key, state in zip(row_keys, row_state):
-    #             if state:
-    #                 yield key
-    #     self.shift_out.write(0)
-
-    def read_bytes(self, keymap):
-        byte_val = 0
-        for i, row_keys in enumerate(keymap):
-            self.shift_out.write(1 << i)
-            row_state = self.shift_in.read()
-            for key, state in zip(row_keys, row_state):
-                byte_val |= state << key
-        self.shift_out.write(0)
-        return byte_val
+        self.mode = mode
+        self.script = None  # The ScriptShiftReg in "script" mode
+        if mode == "spi":
+            scanner = SpiShiftReg(pi, self.ROWS, self.COLS, self.OUT_CHIPS)
+            self._scan = scanner.scan
+            self._select_all = scanner.select_all
+        elif mode == "script":
+            scanner = self.script = ScriptShiftReg(pi, self.ROWS, self.COLS, self.OUT_PINS, self.IN_PINS, self.OUT_CHIPS)
+            self._scan = scanner.scan
+            self._select_all = scanner.select_all
+        elif mode == "bitbang":
+            self._scan = self._scan_bitbang
+            self._select_all = self._select_all_bitbang
+            self.shift_out = OutputShiftReg(pi, *self.OUT_PINS, chips=self.OUT_CHIPS)
+            self.shift_in = InputShiftReg(pi, *self.IN_PINS, chips=self.IN_CHIPS)
+        else:
+            raise ValueError(f"Unknown scan mode: {mode}")
+
+        self._wake = KeyWake(pi, self.WAKE_PINS) if self.WAKE_PINS and hasattr(pi, "callback") else None
+
+        # Per-scan timing, to compare the scan modes
+        self.scan_ns = 0
+        self.scan_count = 0
+        self.scan_ns_total = 0
+
+    # Returns the whole matrix as an int, bit (row * COLS + col) is set while that key is down
+    def scan(self):
+        start = time.perf_counter_ns()
+        state = self._scan()
+        self.scan_ns = time.perf_counter_ns() - start
+        self.scan_count += 1
+        self.scan_ns_total += self.scan_ns
+        return state
+
+    @property
+    def can_idle(self):
+        return self._wake is not None
+
+    # Drives every row and blocks until a key goes down, returns False on timeout
+    def wait_for_key(self, timeout=None):
+        self._select_all()
+        return self._wake.wait(timeout)
+
+    def _select_all_bitbang(self):
+        self.shift_out.write((1 << self.ROWS) - 1)
+
+    # Writes row 0 once, then walks the one along the chain a clock per row
+    def _scan_bitbang(self):
+        shift_out = self.shift_out
+        shift_in = self.shift_in
+        col_mask = (1 << self.COLS) - 1
+
+        shift_out.write(1)
+        state = shift_in.read() & col_mask
+        for i in range(1, self.ROWS):
+            shift_out.shift(0)
+            shift_out.latch()
+            state |= (shift_in.read() & col_mask) << (i * self.COLS)
+        shift_out.write(0)
+        return state
 
 if __name__ == "__main__":
 
+    import sys
+
     import pigpio
 
     print("Connecting to pigpiod")
@@ -42,6 +95,10 @@ if __name__ == "__main__":
     if not pi.connected:
         exit()
 
-    srm = ShiftRegisterMatrix(pi)
+    srm = ShiftRegisterMatrix(pi, *sys.argv[1:2])
 
-    print(srm.read(8, 8))
\ No newline at end of file
+    for _ in range(1000):
+        state = srm.scan()
+    print(f"{srm.mode}: {srm.scan_ns_total / srm.scan_count / 1e6:.3f} ms/scan over {srm.scan_count} scans")
+    for i in range(srm.ROWS):
+        print(f"{i:02d}: {state >> (i * srm.COLS) & ((1 << srm.COLS) - 1):0{srm.COLS}b}")
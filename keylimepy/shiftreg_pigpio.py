@@ -1,73 +1,70 @@
 import pigpio
 
 class OutputShiftReg:
-    
+
     '''
     This class handles writing the values to one or more output shift registers, like a SN75HC595.
 
     Example wiring for SN75HC595 chain:
-    TODO
+
                         First chip
 
-    Pi GPIO ------> SH/LD |1 U 16| Vcc ------ 3V3
-    Pi GPIO ------> CLK   |2   15| CLK INH -- Ground
-                    E     |3   14| D
-                    F     |4   13| C
-                    G     |5   12| B
-                    H     |6   11| A
-    Don't connect   /Qh   |7   10| SER ------ Ground
-    Ground -------- GND   |8    9| Qh ------> next SER
+    Row 1 <-------- QB    |1 U 16| Vcc ------ 3V3
+    Row 2 <-------- QC    |2   15| QA ------> Row 0
+    Row 3 <-------- QD    |3   14| SER <----- Pi GPIO
+    Row 4 <-------- QE    |4   13| /OE ------ Ground
+    Row 5 <-------- QF    |5   12| RCLK <---- Pi GPIO
+    Row 6 <-------- QG    |6   11| SRCLK <--- Pi GPIO
+    Row 7 <-------- QH    |7   10| /SRCLR --- 3V3
+    Ground -------- GND   |8    9| QH' ------> next SER
 
 
-                        Middle chips
+                        Following chips
 
-    prior SH/LD --> SH/LD |1 U 16| Vcc ------ 3V3
-    prior CLK ----> CLK   |2   15| CLK INH -- Ground
-                    E     |3   14| D
-                    F     |4   13| C
-                    G     |5   12| B
-                    H     |6   11| A
-    Don't connect   /Qh   |7   10| SER <----- prior Qh
-    Ground -------- GND   |8    9| Qh ------> next SER
+    Row n+1 <------ QB    |1 U 16| Vcc ------ 3V3
+    Row n+2 <------ QC    |2   15| QA ------> Row n
+    ...                   |3   14| SER <----- prior QH'
+                          |4   13| /OE ------ Ground
+                          |5   12| RCLK <---- prior RCLK
+                          |6   11| SRCLK <--- prior SRCLK
+                          |7   10| /SRCLR --- 3V3
+    Ground -------- GND   |8    9| QH' ------> next SER
 
-
-                        Last chip
-
-    prior SH/LD --> SH/LD |1 U 16| Vcc ------ 3V3
-    prior CLK ----> CLK   |2   15| CLK INH -- Ground
-                    E     |3   14| D
-                    F     |4   13| C
-                    G     |5   12| B
-                    H     |6   11| A
-    Don't connect   /Qh   |7   10| SER <----- prior Qh
-    Ground -------- GND   |8    9| Qh ------> Pi GPIO
+    Bit i of the value written drives output i of the chain, QA of the first chip is
+    output 0. The whole chain is shifted and then latched once.
 
     '''
 
-    DATA_PIN = 16
-    LATCH_PIN = 17  # 2x 8-Bit Registers
-    CLOCK_PIN = 18
-    NUM_BITS = 8
-
-    def __init__(self, pi):
+    def __init__(self, pi, SER, RCLK, SRCLK, chips=1):
         self._pi = pi
-        
-        pi.set_mode(self.DATA_PIN, pigpio.OUTPUT)
-        pi.set_mode(self.LATCH_PIN, pigpio.OUTPUT)
-        pi.set_mode(self.CLOCK_PIN, pigpio.OUTPUT)
+        self._ser = SER
+        self._rclk = RCLK
+        self._srclk = SRCLK
+        self.num_bits = chips * 8
+
+        for pin in (SER, RCLK, SRCLK):
+            pi.set_mode(pin, pigpio.OUTPUT)
+            pi.write(pin, 0)
+        self._ser_level = 0
+
+    # Clocks one bit into the chain, without changing the outputs
+    def shift(self, bit):
+        if bit != self._ser_level:
+            self._pi.write(self._ser, bit)
+            self._ser_level = bit
+        self._pi.write(self._srclk, 1)
+        self._pi.write(self._srclk, 0)
+
+    # Copies the chain to the outputs
+    def latch(self):
+        self._pi.write(self._rclk, 1)
+        self._pi.write(self._rclk, 0)
 
     def write(self, data):
-        self._pi.write(self.CLOCK_PIN, 0)
-        self._pi.write(self.LATCH_PIN, 0)
-        self._pi.write(self.CLOCK_PIN, 1)
         # Write in reverse order
-        for i in range(self.NUM_BITS, -1, -1):
-            self._pi.write(self.CLOCK_PIN, 0)
-            self._pi.write(self.DATA_PIN, data & 1 << i)
-            self._pi.write(self.CLOCK_PIN, 1)
-        self._pi.write(self.CLOCK_PIN, 0)
-        self._pi.write(self.LATCH_PIN, 1)
-        self._pi.write(self.CLOCK_PIN, 1)
+        for i in range(self.num_bits - 1, -1, -1):
+            self.shift(data >> i & 1)
+        self.latch()
 
 
 class InputShiftReg:
@@ -114,27 +111,30 @@ class InputShiftReg:
 
     '''
 
-    DATA_PIN = 19
-    LATCH_PINS = (20, 21)  # 2x 8-Bit Registers
-    CLOCK_PIN = 22
-    NUM_BITS = 16
-
-    def __init__(self, pi):
+    def __init__(self, pi, QH, SH_LD, CLK, chips=1):
         self._pi = pi
-
-        pi.set_mode(self.DATA_PIN, pigpio.INPUT)
-        pi.set_mode(self.LATCH_PINS, pigpio.OUTPUT)
-        pi.set_mode(self.CLOCK_PIN, pigpio.OUTPUT)
-
+        self._qh = QH
+        self._sh_ld = SH_LD
+        self._clk = CLK
+        self.num_bits = chips * 8
+
+        pi.set_mode(QH, pigpio.INPUT)
+        pi.set_mode(SH_LD, pigpio.OUTPUT)
+        pi.set_mode(CLK, pigpio.OUTPUT)
+        pi.write(SH_LD, 1)
+        pi.write(CLK, 0)
+
+    # Loads every chip at once and shifts the whole chain in, bit i of the result is the
+    # i-th bit shifted in (H of the last chip is bit 0)
     def read(self):
-        for latch_pin in self.LATCH_PINS:
-            self._pi.write(self.CLOCK_PIN, 0)
-            self._pi.write(latch_pin, 0)
-            self._pi.write(self.CLOCK_PIN, 1)
-            for _ in range(self.NUM_BITS, -1, -1):
-                self._pi.write(self.CLOCK_PIN, 0)
-                yield self._pi.read(self.DATA_PIN)
-                self._pi.write(self.CLOCK_PIN, 1)
-            self._pi.write(self.CLOCK_PIN, 0)
-            self._pi.write(latch_pin, 1)
-            self._pi.write(self.CLOCK_PIN, 1)
\ No newline at end of file
+        pi = self._pi
+        qh = self._qh
+        clk = self._clk
+        pi.write(self._sh_ld, 0)
+        pi.write(self._sh_ld, 1)
+        value = pi.read(qh)
+        for i in range(1, self.num_bits):
+            pi.write(clk, 1)
+            pi.write(clk, 0)
+            value |= pi.read(qh) << i
+        return value
\ No newline at end of file
@@ -1,71 +1,65 @@
 import RPi.GPIO as GPIO
 
 class OutputShiftReg:
-    
+
     '''
     This class handles writing the values to one or more output shift registers, like a SN75HC595.
 
     Example wiring for SN75HC595 chain:
-    TODO
+
                         First chip
 
-    Pi GPIO ------> SH/LD |1 U 16| Vcc ------ 3V3
-    Pi GPIO ------> CLK   |2   15| CLK INH -- Ground
-                    E     |3   14| D
-                    F     |4   13| C
-                    G     |5   12| B
-                    H     |6   11| A
-    Don't connect   /Qh   |7   10| SER ------ Ground
-    Ground -------- GND   |8    9| Qh ------> next SER
+    Row 1 <-------- QB    |1 U 16| Vcc ------ 3V3
+    Row 2 <-------- QC    |2   15| QA ------> Row 0
+    Row 3 <-------- QD    |3   14| SER <----- Pi GPIO
+    Row 4 <-------- QE    |4   13| /OE ------ Ground
+    Row 5 <-------- QF    |5   12| RCLK <---- Pi GPIO
+    Row 6 <-------- QG    |6   11| SRCLK <--- Pi GPIO
+    Row 7 <-------- QH    |7   10| /SRCLR --- 3V3
+    Ground -------- GND   |8    9| QH' ------> next SER
 
 
-                        Middle chips
+                        Following chips
 
-    prior SH/LD --> SH/LD |1 U 16| Vcc ------ 3V3
-    prior CLK ----> CLK   |2   15| CLK INH -- Ground
-                    E     |3   14| D
-                    F     |4   13| C
-                    G     |5   12| B
-                    H     |6   11| A
-    Don't connect   /Qh   |7   10| SER <----- prior Qh
-    Ground -------- GND   |8    9| Qh ------> next SER
+    Row n+1 <------ QB    |1 U 16| Vcc ------ 3V3
+    Row n+2 <------ QC    |2   15| QA ------> Row n
+    ...                   |3   14| SER <----- prior QH'
+                          |4   13| /OE ------ Ground
+                          |5   12| RCLK <---- prior RCLK
+                          |6   11| SRCLK <--- prior SRCLK
+                          |7   10| /SRCLR --- 3V3
+    Ground -------- GND   |8    9| QH' ------> next SER
 
+    Bit i of the value written drives output i of the chain, QA of the first chip is
+    output 0. The whole chain is shifted and then latched once.
 
-                        Last chip
+    '''
 
-    prior SH/LD --> SH/LD |1 U 16| Vcc ------ 3V3
-    prior CLK ----> CLK   |2   15| CLK INH -- Ground
-                    E     |3   14| D
-                    F     |4   13| C
-                    G     |5   12| B
-                    H     |6   11| A
-    Don't connect   /Qh   |7   10| SER <----- prior Qh
-    Ground -------- GND   |8    9| Qh ------> Pi GPIO
+    def __init__(self, SER=16, RCLK=20, SRCLK=21, chips=1):
+        self._ser = SER
+        self._rclk = RCLK
+        self._srclk = SRCLK
+        self.num_bits = chips * 8
 
-    '''
+        for pin in (SER, RCLK, SRCLK):
+            GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
 
-    DATA_PIN = 16
-    LATCH_PIN = 20
-    CLOCK_PIN = 21
-    NUM_BITS = 8
+    # Clocks one bit into the chain, without changing the outputs
+    def shift(self, bit):
+        GPIO.output(self._ser, bit)
+        GPIO.output(self._srclk, 1)
+        GPIO.output(self._srclk, 0)
 
-    def __init__(self):
-        GPIO.setup(self.DATA_PIN, GPIO.OUT)
-        GPIO.setup(self.LATCH_PIN, GPIO.OUT)
-        GPIO.setup(self.CLOCK_PIN, GPIO.OUT)
+    # Copies the chain to the outputs
+    def latch(self):
+        GPIO.output(self._rclk, 1)
+        GPIO.output(self._rclk, 0)
 
     def write(self, data):
-        GPIO.output(self.CLOCK_PIN, 0)
-        GPIO.output(self.LATCH_PIN, 0)
-        GPIO.output(self.CLOCK_PIN, 1)
         # Write in reverse order
-        for i in range(self.NUM_BITS, -1, -1):
-            GPIO.output(self.CLOCK_PIN, 0)
-            GPIO.output(self.DATA_PIN, 1 if (data & (1 << i)) else 0)
-            GPIO.output(self.CLOCK_PIN, 1)
-        GPIO.output(self.CLOCK_PIN, 0)
-        GPIO.output(self.LATCH_PIN, 1)
-        GPIO.output(self.CLOCK_PIN, 1)
+        for i in range(self.num_bits - 1, -1, -1):
+            self.shift(data >> i & 1)
+        self.latch()
 
 
 class InputShiftReg:
@@ -112,29 +106,24 @@ class InputShiftReg:
 
     '''
 
-    DATA_PIN = 9 #19
-    LATCH_PIN = 25 # (20, 21)  # 2x 8-Bit Registers
-    CLOCK_PIN = 11 #22
-    NUM_BITS = 16
-
-    def __init__(self):
-        GPIO.setup(self.DATA_PIN, GPIO.IN)
-        GPIO.setup(self.LATCH_PIN, GPIO.OUT)
-        GPIO.setup(self.CLOCK_PIN, GPIO.OUT)
+    def __init__(self, QH=9, SH_LD=25, CLK=11, chips=2):
+        self._qh = QH
+        self._sh_ld = SH_LD
+        self._clk = CLK
+        self.num_bits = chips * 8
 
-        # GPIO.set_pull_up_down(self.DATA_PIN, pigpio.PUD_UP)
+        GPIO.setup(QH, GPIO.IN)
+        GPIO.setup(SH_LD, GPIO.OUT, initial=GPIO.HIGH)
+        GPIO.setup(CLK, GPIO.OUT, initial=GPIO.LOW)
 
+    # Loads every chip at once and shifts the whole chain in, bit i of the result is the
+    # i-th bit shifted in (H of the last chip is bit 0)
     def read(self):
-        bits = []
-        # for latch_pin in self.LATCH_PIN:
-        GPIO.output(self.CLOCK_PIN, 0)
-        GPIO.output(self.LATCH_PIN, 0)
-        GPIO.output(self.CLOCK_PIN, 1)
-        for _ in range(self.NUM_BITS, -1, -1):
-            GPIO.output(self.CLOCK_PIN, 0)
-            bits.append(GPIO.INPUT(self.DATA_PIN))
-            GPIO.output(self.CLOCK_PIN, 1)
-        GPIO.output(self.CLOCK_PIN, 0)
-        GPIO.output(self.LATCH_PIN, 1)
-        GPIO.output(self.CLOCK_PIN, 1)
-        return bits
+        GPIO.output(self._sh_ld, 0)
+        GPIO.output(self._sh_ld, 1)
+        value = GPIO.input(self._qh)
+        for i in range(1, self.num_bits):
+            GPIO.output(self._clk, 1)
+            GPIO.output(self._clk, 0)
+            value |= GPIO.input(self._qh) << i
+        return value
@@ -0,0 +1,131 @@
+import time
+
+import pigpio
+
+class ScriptShiftReg:
+
+    '''
+    This class scans a key matrix by running a pigpio script inside the daemon, with a
+    SN74HC595 chain driving the rows and a SN74HC165 chain reading the columns.
+
+    The clock and latch sequence never changes, so the whole scan is stored as a script
+    once and every scan is a run_script call, a sleep for the row settle times, then
+    script_status polls until it halts. Each row's column bits are left in one script
+    parameter (p0-p9), which limits the matrix to 10 rows of up to 32 columns.
+
+    If pigpiod doesn't finish the script within SCAN_TIMEOUT, the scan is counted in
+    timeouts and returns the last state it read. Later scans keep returning that state
+    without starting the script again until the stalled run has halted.
+
+    The 595 chain is cleared and a single one is shifted in, then walked one output
+    further for every row, so row i is driven from Qi of the chain.
+
+    '''
+
+    MAX_ROWS = 10
+    MAX_COLS = 32
+    SETTLE_US = 5  # Time for the column lines to settle after a row is selected
+    INIT_TIMEOUT = 1.0
+    SCAN_TIMEOUT = 0.1
+
+    def __init__(self, pi, rows, cols, out_pins, in_pins, out_chips=1):
+        if rows > self.MAX_ROWS or cols > self.MAX_COLS:
+            raise ValueError(f"A script scan supports up to {self.MAX_ROWS}x{self.MAX_COLS} keys, not {rows}x{cols}")
+
+        self._pi = pi
+        self._rows = rows
+        self._cols = cols
+        self._col_mask = (1 << cols) - 1
+        # The script can't halt before its MICS waits are over, so there's no point polling sooner
+        self._settle_s = rows * self.SETTLE_US / 1000000
+        self._state = 0  # Last state read
+        self._stalled = False  # Set while a timed out run may still be going
+        self.timeouts = 0
+
+        ser, rclk, srclk = out_pins
+        self._out_pins = out_pins
+        self._out_bits = out_chips * 8
+        qh, sh_ld, clk = in_pins
+        for pin in (ser, rclk, srclk, sh_ld, clk):
+            pi.set_mode(pin, pigpio.OUTPUT)
+        pi.set_mode(qh, pigpio.INPUT)
+        pi.write(sh_ld, 1)
+
+        self._script = pi.store_script(self._build(rows, cols, out_chips * 8, ser, rclk, srclk, qh, sh_ld, clk))
+        deadline = time.monotonic() + self.INIT_TIMEOUT
+        while pi.script_status(self._script)[0] == pigpio.PI_SCRIPT_INITING:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Timed out waiting for the scan script to initialise")
+
+    def _build(self, rows, cols, out_bits, ser, rclk, srclk, qh, sh_ld, clk):
+        cmds = [f"W {rclk} 0", f"W {srclk} 0", f"W {clk} 0"]
+
+        # Clear the row chain, then shift in the one that walks through the rows
+        cmds += [f"W {ser} 0", f"LD v0 {out_bits}", "TAG 0",
+                 f"W {srclk} 1", f"W {srclk} 0", "DCR v0", "LDA v0", "JNZ 0"]
+        cmds += [f"W {ser} 1", f"W {srclk} 1", f"W {srclk} 0", f"W {ser} 0"]
+
+        for i in range(rows):
+            if i:
+                cmds += [f"W {srclk} 1", f"W {srclk} 0"]
+            cmds += [f"W {rclk} 1", f"W {rclk} 0"]
+            if self.SETTLE_US:
+                cmds += [f"MICS {self.SETTLE_US}"]
+            cmds += [f"W {sh_ld} 0", f"W {sh_ld} 1"]
+
+            # v1 = (v1 >> 1) | (QH << cols - 1), so the first bit read ends up as column 0
+            cmds += ["LD v1 0", f"LD v0 {cols}", f"TAG {i + 1}",
+                     "LDA v1", "RRA 1", "STA v1", f"R {qh}", f"RLA {cols - 1}", "OR v1", "STA v1",
+                     f"W {clk} 1", f"W {clk} 0", "DCR v0", "LDA v0", f"JNZ {i + 1}",
+                     "LDA v1", f"STA p{i}"]
+
+        # Walk the one off the driven rows
+        cmds += [f"W {srclk} 1", f"W {srclk} 0", f"W {rclk} 1", f"W {rclk} 0"]
+        return " ".join(cmds)
+
+    def close(self):
+        self._pi.delete_script(self._script)
+
+    # Drives every row at once, for waiting on a key while idle. Only happens when going
+    # idle, so it just clocks the bits out directly.
+    def select_all(self):
+        pi = self._pi
+        ser, rclk, srclk = self._out_pins
+        for i in range(self._out_bits - 1, -1, -1):
+            pi.write(ser, int(i < self._rows))
+            pi.write(srclk, 1)
+            pi.write(srclk, 0)
+        pi.write(ser, 0)
+        pi.write(rclk, 1)
+        pi.write(rclk, 0)
+
+    def scan(self):
+        pi = self._pi
+        script = self._script
+        if self._stalled:
+            if pi.script_status(script)[0] == pigpio.PI_SCRIPT_RUNNING:
+                self.timeouts += 1
+                return self._state
+            self._stalled = False
+        pi.run_script(script)
+        if self._settle_s:
+            time.sleep(self._settle_s)
+        status, params = pi.script_status(script)
+        if status == pigpio.PI_SCRIPT_RUNNING:
+            deadline = time.monotonic() + self.SCAN_TIMEOUT
+            while status == pigpio.PI_SCRIPT_RUNNING:
+                if time.monotonic() > deadline:
+                    self._stalled = True
+                    self.timeouts += 1
+                    return self._state
+                status, params = pi.script_status(script)
+        if status != pigpio.PI_SCRIPT_HALTED:
+            raise RuntimeError(f"Scan script stopped with status {status}")
+
+        col_mask = self._col_mask
+        cols = self._cols
+        state = 0
+        for i in range(self._rows):
+            state |= (params[i] & col_mask) << (i * cols)
+        self._state = state
+        return state
@@ -0,0 +1,73 @@
+import pigpio
+
+# Bit-reversal table, SPI receives MSB first but column 0 is the first bit shifted in
+_REVERSED = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+class SpiShiftReg:
+
+    '''
+    This class scans a key matrix through the Pi's hardware SPI, with a SN74HC595 chain
+    driving the rows and a SN74HC165 chain reading the columns. Both chains share the
+    SPI clock, so each transfer shifts out the next row select while shifting in the
+    column bits of the row that is currently selected.
+
+    Example wiring for SPI0:
+
+    Pi SCLK (GPIO 11) ----> 595 SRCLK and 165 CLK (every chip)
+    Pi MOSI (GPIO 10) ----> SER of the first 595
+    Pi MISO (GPIO 9) <----- Qh of the last 165
+    Pi CE0  (GPIO 8) -----> 595 RCLK (every chip), latches when a transfer ends
+    Pi GPIO (GPIO 25) ----> 165 SH/LD (every chip)
+
+    A scan costs one transfer plus one load pulse per row, instead of one pigpiod
+    call per clock edge.
+
+    '''
+
+    SPI_CHANNEL = 0
+    SPI_BAUD = 2000000
+    SPI_FLAGS = 0  # Mode 0, active low CE, main SPI
+    LOAD_PIN = 25
+    LOAD_PULSE_US = 1
+
+    def __init__(self, pi, rows, cols, out_chips=1):
+        self._pi = pi
+        self._rows = rows
+        self._cols = cols
+        self._col_mask = (1 << cols) - 1
+        self._in_bytes = (cols + 7) // 8
+
+        num_bytes = max(out_chips, self._in_bytes)
+        # Row select for each transfer, the last one releases every row
+        self._select = [(1 << i).to_bytes(num_bytes, 'big') for i in range(rows)]
+        self._select.append(bytes(num_bytes))
+        self._select_all = ((1 << rows) - 1).to_bytes(num_bytes, 'big')
+
+        pi.set_mode(self.LOAD_PIN, pigpio.OUTPUT)
+        pi.write(self.LOAD_PIN, 1)
+        self._handle = pi.spi_open(self.SPI_CHANNEL, self.SPI_BAUD, self.SPI_FLAGS)
+
+    def close(self):
+        self._pi.spi_close(self._handle)
+
+    # Drives every row at once, for waiting on a key while idle
+    def select_all(self):
+        self._pi.spi_xfer(self._handle, self._select_all)
+
+    def scan(self):
+        pi = self._pi
+        handle = self._handle
+        select = self._select
+        in_bytes = self._in_bytes
+        col_mask = self._col_mask
+        cols = self._cols
+
+        state = 0
+        pi.spi_xfer(handle, select[0])
+        for i in range(self._rows):
+            # Load the columns of the selected row, then shift them in while selecting the next row
+            pi.gpio_trigger(self.LOAD_PIN, self.LOAD_PULSE_US, 0)
+            _, rx = pi.spi_xfer(handle, select[i + 1])
+            row = int.from_bytes(bytes(rx[:in_bytes]).translate(_REVERSED), 'little')
+            state |= (row & col_mask) << (i * cols)
+        return state
@@ -0,0 +1,94 @@
+import os
+import socket
+import threading
+import time
+
+class Telemetry:
+
+    '''
+    This class is a registry of counters and gauges, formatted as Prometheus text.
+
+    The values themselves stay plain int/float attributes of the objects that update them
+    (scanner.Scanner, usb_kb_output.UsbKeyboardOutput, the debouncers, ...), so the scan
+    thread only ever does an integer increment. A metric here is a function reading one,
+    and format() just reads them all. Reading an attribute needs no lock and an int is
+    never seen half written, so the scan thread never waits on a reader.
+
+    '''
+
+    PREFIX = "keylimepi_"
+
+    def __init__(self):
+        self._metrics = []
+        self._rates = {}  # Metric name to the (time, value) it was last read at
+
+    def add(self, name, kind, help, read):
+        self._metrics.append((self.PREFIX + name, kind, help, read))
+
+    # Adds a metric reading obj.attr, skipped if obj is None
+    def add_attr(self, obj, attr, name, kind, help):
+        if obj is not None:
+            self.add(name, kind, help, lambda: getattr(obj, attr))
+
+    # Adds a gauge of how fast read() has gone up per second since the last format()
+    def add_rate(self, name, help, read):
+        name = self.PREFIX + name
+
+        def rate():
+            now, value = time.monotonic(), read()
+            last = self._rates.get(name)
+            self._rates[name] = now, value
+            if last is None or now <= last[0]:
+                return 0.0
+            return (value - last[1]) / (now - last[0])
+
+        self._metrics.append((name, "gauge", help, rate))
+
+    def format(self):
+        lines = []
+        for name, kind, help, read in self._metrics:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+
+class TelemetryServer(threading.Thread):
+
+    '''
+    This thread serves Telemetry.format() on a Unix socket, each connection gets one
+    snapshot and is closed, e.g.
+
+        socat - UNIX-CONNECT:/run/keylimepi.sock
+
+    '''
+
+    def __init__(self, telemetry, path):
+        super().__init__(name="telemetry", daemon=True)
+        self.telemetry = telemetry
+        self.path = path
+        self._server = None
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+
+    def run(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    conn.sendall(self.telemetry.format().encode())
+                except OSError:
+                    pass
@@ -1,4 +1,4 @@
-import codecs
+import os
 
 from usb_hid_scancodes import scancodes
 
@@ -10,41 +10,153 @@ class UsbKeyboardOutput:
     # DEVICE = '/dev/hidg0'
     DEVICE = '.dev.hidg0'
     NONE_KEY = scancodes['KEY_NONE']
-    MOD_KEYS = ("KEY_MOD_LCTRL", "KEY_MOD_LSHIFT", "KEY_MOD_LALT", "KEY_MOD_LMETA", "KEY_MOD_RCTRL", "KEY_MOD_RSHIFT", "KEY_MOD_RALT", "KEY_MOD_RMETA")
+    OVF_KEYS = bytes([scancodes['KEY_ERR_OVF']] * KEY_BYTES)
+    OVF_BIT = 1 << scancodes['KEY_ERR_OVF']
 
-    ENABLE_NKRO = True
+    # Reports are built from a usage bitmap (see keymap.CompiledKeymap), bit n set while usage n is down
+    MOD_USAGE = 0xe0
+    KEYS_MASK = (1 << MOD_USAGE) - 1
 
-    def _write(self, out_bytes):
-        print(out_bytes)
+    # The gadget has two keyboard interfaces, see keylimepi.sh. DEVICE is the boot keyboard,
+    # 8 byte 6KRO reports a BIOS/UEFI host can read, and NKRO_DEVICE a bitmap of usages
+    # 0x00-0xdf (bit n at byte n // 8, bit n % 8) that only a report protocol host reads.
+    # The modifiers and the first 6 keys down go to the boot keyboard, any more keys go to
+    # the bitmap, and a key never moves between the two while it's held. A report here is the two together, the boot report
+    # then the bitmap.
+    # NKRO_DEVICE = '/dev/hidg2'
+    NKRO_DEVICE = '.dev.hidg2'
+    BOOT_BYTES = MOD_BYTES + KEY_BYTES
+    REPORT_BYTES = BOOT_BYTES + MOD_USAGE // 8
 
-        with open(self.DEVICE, 'wb+') as kb:
-            kb.write(''.join([chr(e) for e in out_bytes]).encode())
+    # HID SET_PROTOCOL values, in boot protocol every key goes to the boot keyboard
+    PROTOCOL_BOOT = 0
+    PROTOCOL_REPORT = 1
 
-    def write_6kro(self, active_keys):
-        keys = set()
-        mods = set()
-        for key in active_keys:
-            (mods if key in self.MOD_KEYS else keys).add(eval(key, scancodes))
-        num_keys = len(keys)
+    def __init__(self, device=None, protocol=PROTOCOL_REPORT, nkro_device=None):
+        # Opened once for the life of the process, writes never block the scan loop
+        self._fd = os.open(device or self.DEVICE, os.O_RDWR | os.O_NONBLOCK | os.O_CREAT)
+        self._nkro_fd = os.open(nkro_device or self.NKRO_DEVICE, os.O_RDWR | os.O_NONBLOCK | os.O_CREAT)
+        self._last_report = bytearray(self.REPORT_BYTES)
+        self.pending = False  # Set while a report is waiting to be written
+        self._report_6kro = bytearray(self.REPORT_BYTES)
+        self._report_nkro = bytearray(self.REPORT_BYTES)
+        self._boot_keys = 0  # Usages on the boot keyboard in the last NKRO report
+        self._nkro_keys = 0  # and in its bitmap
+        self.protocol = protocol
 
-        if num_keys > self.KEY_BYTES:
-            key_bytes = [scancodes['KEY_ERR_OVF']] * self.KEY_BYTES
-        else:
-            key_bytes = keys + [self.NONE_KEY for _ in range(self.KEY_BYTES - num_keys)]        
+        # Counters, only ever incremented by the scan thread (see telemetry.py)
+        self.report_count = 0
+        self.eagain_count = 0
+        self.write_errors = 0
 
-        self._write([sum(mods), self.NONE_KEY] + key_bytes)
+    def close(self):
+        os.close(self._fd)
+        os.close(self._nkro_fd)
+
+    # The gadget fd, the host's LED output reports are read from it (see host_leds.py)
+    def fileno(self):
+        return self._fd
+
+    # Only writes the parts of the report that differ from the last ones sent, returns
+    # True if anything was written
+    def write_report(self, report):
+        if report == self._last_report:
+            # The host already has it, nothing is waiting any more
+            self.pending = False
+            return False
+        written = self._write_part(self._fd, report, 0, self.BOOT_BYTES)
+        written = self._write_part(self._nkro_fd, report, self.BOOT_BYTES, self.REPORT_BYTES) or written
+        self.pending = report != self._last_report
+        return written
+
+    def _write_part(self, fd, report, start, end):
+        last = self._last_report
+        if report[start:end] == last[start:end]:
+            return False
+        try:
+            os.write(fd, memoryview(report)[start:end])
+        except BlockingIOError:
+            # The host hasn't read the last report yet, try again on the next scan
+            self.eagain_count += 1
+            return False
+        except OSError:
+            # e.g. ESHUTDOWN while unplugged, keep trying rather than stop scanning
+            self.write_errors += 1
+            return False
+        last[start:end] = report[start:end]
+        self.report_count += 1
+        return True
+
+    # Switches report format without losing key state, the pending flag makes the
+    # scanner send the current keys again in the new format on its next scan
+    def set_protocol(self, protocol):
+        if protocol != self.protocol:
+            self.protocol = protocol
+            self.pending = True
+
+    def write(self, usages):
+        return self.write_report(self.build(usages))
+
+    def write_6kro(self, usages):
+        return self.write_report(self.build_6kro(usages))
 
     # https://www.devever.net/~hl/usbnkro
-    def write_nkro(self, active_keys):
-        keys = set()
-        mods = set()
-        for key in active_keys:
-            (mods if key in self.MOD_KEYS else keys).add(eval(key, scancodes))
-        keys_val = 0
-        for key in keys:
-            if key > 0x67:
-                continue
-            keys_val += 1 << key
-        keys_val += 1 << 67
-                
-        self._write(codecs.decode(f"{sum(mods):02x}{self.NONE_KEY:02x}{(0x01+0x02):02x}{(0x03+0x04):02x}{(0x05+0x06):02x}{keys_val:026x}", 'hex_codec'))
\ No newline at end of file
+    def write_nkro(self, usages):
+        return self.write_report(self.build_nkro(usages))
+
+    # The build methods fill in and return a preallocated report, it's only valid until the next build
+    def build(self, usages):
+        if self.protocol == self.PROTOCOL_BOOT:
+            return self.build_6kro(usages)
+        return self.build_nkro(usages)
+
+    # Takes the lowest usages first, and stops at the seventh key since that's rollover,
+    # as is KEY_ERR_OVF in the usages (see ghost.GhostFilter). The bitmap is left empty.
+    def build_6kro(self, usages):
+        self._boot_keys = self._nkro_keys = 0
+        return self._build_boot(self._report_6kro, usages)
+
+    # Keys already down stay where they are, new ones fill the boot keyboard's free slots
+    # lowest first, and the rest go to the bitmap
+    def build_nkro(self, usages):
+        keys = usages & self.KEYS_MASK
+        ovf = keys & self.OVF_BIT
+        keys ^= ovf
+        boot = self._boot_keys & keys
+        held = self._nkro_keys & keys
+        new = keys & ~(boot | held)
+        free = self.KEY_BYTES - bin(boot).count("1")
+        while new and free:
+            low = new & -new
+            boot |= low
+            new ^= low
+            free -= 1
+        rest = held | new
+        self._boot_keys = boot
+        self._nkro_keys = rest
+
+        report = self._build_boot(self._report_nkro, usages & ~self.KEYS_MASK | boot | ovf)
+        report[self.BOOT_BYTES:] = rest.to_bytes(self.REPORT_BYTES - self.BOOT_BYTES, 'little')
+        return report
+
+    # Fills in the boot report at the start of report
+    def _build_boot(self, report, usages):
+        report[0] = usages >> self.MOD_USAGE & 0xff
+        bits = usages & self.KEYS_MASK
+        if bits & self.OVF_BIT:
+            report[self.MOD_BYTES:self.BOOT_BYTES] = self.OVF_KEYS
+            return report
+        i = self.MOD_BYTES
+        end = self.BOOT_BYTES
+        while bits:
+            if i == end:
+                report[self.MOD_BYTES:end] = self.OVF_KEYS
+                return report
+            low = bits & -bits
+            report[i] = low.bit_length() - 1
+            bits ^= low
+            i += 1
+        while i < end:
+            report[i] = self.NONE_KEY
+            i += 1
+        return report
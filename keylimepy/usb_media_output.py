@@ -0,0 +1,75 @@
+import os
+
+# KEY_MEDIA_* codes (0xe8-0xfb in usb_hid_scancodes) aren't keyboard page usages, so they
+# go out on their own HID function: Consumer Control (report 1) and System Control
+# (report 2). See hid.usb1 in keylimepi.sh for the matching report descriptor, the
+# consumer usages there are listed in KEY_MEDIA_* order, skipping KEY_MEDIA_SLEEP.
+
+MEDIA_USAGE = 0xe8
+NUM_MEDIA = 20
+SLEEP_BIT = 0xf8 - MEDIA_USAGE  # KEY_MEDIA_SLEEP, the only System Control key
+
+# USB Media Key Output
+class UsbMediaOutput:
+    # DEVICE = '/dev/hidg1'
+    DEVICE = '.dev.hidg1'
+
+    CONSUMER_REPORT_ID = 1
+    SYSTEM_REPORT_ID = 2
+    MEDIA_MASK = ((1 << NUM_MEDIA) - 1) << MEDIA_USAGE
+    CONSUMER_LOW_MASK = (1 << SLEEP_BIT) - 1
+
+    def __init__(self, device=None):
+        self._fd = os.open(device or self.DEVICE, os.O_RDWR | os.O_NONBLOCK | os.O_CREAT)
+        self._consumer_report = bytearray((self.CONSUMER_REPORT_ID, 0, 0, 0))
+        self._system_report = bytearray((self.SYSTEM_REPORT_ID, 0))
+        self._last_media = 0
+        self.pending = False  # Set while a report is waiting to be written
+
+        # Counters, only ever incremented by the scan thread (see telemetry.py)
+        self.report_count = 0
+        self.eagain_count = 0
+        self.write_errors = 0
+
+    def close(self):
+        os.close(self._fd)
+
+    def _write(self, report):
+        try:
+            os.write(self._fd, report)
+        except BlockingIOError:
+            self.eagain_count += 1
+            self.pending = True
+            return False
+        except OSError:
+            self.write_errors += 1
+            self.pending = True
+            return False
+        self.report_count += 1
+        return True
+
+    # Takes a usage bitmap, the same as UsbKeyboardOutput, and only writes the report of
+    # a page whose keys changed. Returns True if anything was written.
+    def write(self, usages):
+        media = usages & self.MEDIA_MASK
+        changed = media ^ self._last_media
+        if not changed:
+            # Back to what the host already has, nothing is waiting any more
+            self.pending = False
+            return False
+
+        self.pending = False
+        written = False
+        if changed & ~(1 << (SLEEP_BIT + MEDIA_USAGE)):
+            media_bits = media >> MEDIA_USAGE
+            consumer = media_bits & self.CONSUMER_LOW_MASK | media_bits >> (SLEEP_BIT + 1) << SLEEP_BIT
+            self._consumer_report[1:] = consumer.to_bytes(3, 'little')
+            written = self._write(self._consumer_report)
+        if changed & 1 << (SLEEP_BIT + MEDIA_USAGE):
+            self._system_report[1] = media >> (SLEEP_BIT + MEDIA_USAGE) & 1
+            written = self._write(self._system_report) or written
+
+        # Keep the old state on a failed write, so the next call sends it again
+        if not self.pending:
+            self._last_media = media
+        return written